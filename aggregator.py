@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# Solar display - Showing solar/energy production/consumption on an M5Stack
+# Copyright (C) 2020 - Kenneth Henderick <kenneth@ketronic.be>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+Aggregator service, running on a regular (CPython) host. It subscribes once to the emonPi's
+MQTT broker, does the pairing, bucketing and stats for all displays and publishes the results
+as retained binary frames (see `frames.py`) on `<aggregator_topic>/live` and
+`<aggregator_topic>/history`.
+
+Usage: python3 aggregator.py [config.json]
+Requires paho-mqtt.
+"""
+import json
+import sys
+import time
+import paho.mqtt.client as mqtt
+from feeds import FeedStore, FeedSampler, build_registry, parse_centi, USAGE, SAMPLE, BUCKET
+from backfill import fill as backfill_feed
+import frames
+
+
+class Aggregator(object):
+
+    def __init__(
+        self,
+        solar_topic, grid_topic, mqtt_broker, aggregator_topic,
+        graph_interval_s=60, feeds=None, backfill=None
+    ):
+        self._feed_ids, self._feed_names, _ = build_registry(solar_topic, grid_topic, feeds)
+        self._feed_count = len(self._feed_names)
+        self._mqtt_broker = mqtt_broker
+        self._live_topic = '{0}/live'.format(aggregator_topic)
+        self._history_topic = '{0}/history'.format(aggregator_topic)
+        self._graph_interval = graph_interval_s
+        self._backfill_config = backfill
+
+        self._store = FeedStore(self._feed_count)
+        self._sampler = FeedSampler(self._store, self._graph_interval)
+        self._averages = [0] * self._feed_count
+        self._buffer_min = [0] * self._feed_count
+        self._buffer_max = [0] * self._feed_count
+        self._buffer_avg = [0.0] * self._feed_count
+        self._buffer_stddev = [0.0] * self._feed_count
+        self._buffer_median = [0] * self._feed_count
+        self._buffer_p90 = [0] * self._feed_count
+
+        try:
+            self._mqtt = mqtt.Client(mqtt.CallbackAPIVersion.VERSION1, 'solar_display_aggregator')
+        except AttributeError:  # paho-mqtt < 2.0
+            self._mqtt = mqtt.Client('solar_display_aggregator')
+        self._mqtt.username_pw_set('emonpi', 'emonpimqtt2016')
+        self._mqtt.on_connect = self._on_connect
+        self._mqtt.on_message = self._process_data
+
+    def run(self):
+        if self._backfill_config is not None:
+            self._backfill()
+        self._mqtt.connect(self._mqtt_broker)
+        self._mqtt.loop_forever()
+
+    def _backfill(self):
+        """ Fills the complete graph window with history from emoncms """
+        now = time.time()
+        rounded_now = int(now - now % self._graph_interval)
+        count = self._store.size
+        start = rounded_now - count * self._graph_interval
+        self._store.extend(count)
+        feed_ids = self._backfill_config['feed_ids']
+        for feed_id, name in enumerate(self._feed_names):
+            if feed_id == USAGE or name not in feed_ids:
+                continue
+            try:
+                backfill_feed(self._store, feed_id, self._backfill_config['url'], self._backfill_config.get('apikey', ''),
+                              feed_ids[name], start, count, self._graph_interval)
+            except Exception as ex:
+                print('Exception in backfill ({0}): {1}'.format(name, ex))
+        self._store.recalculate_usage(0)
+        self._sampler.last_value_added = rounded_now
+        self._calculate_buffer_stats()
+
+    def _on_connect(self, client, userdata, flags, rc):
+        _ = userdata, flags
+        print('Connected to MQTT ({0})'.format(rc))
+        client.subscribe('emon/#')
+        if self._sampler.last_value_added is not None:
+            self._publish_history()
+
+    def _process_data(self, client, userdata, message):
+        """ Process MQTT message """
+        _ = client, userdata
+        feed_id = self._feed_ids.get(message.topic)
+        if feed_id is None:
+            return
+        try:
+            value = parse_centi(message.payload)
+        except ValueError:
+            return
+        result = self._sampler.process(feed_id, value, time.time())
+        if result & BUCKET:
+            self._calculate_buffer_stats()
+            self._publish_history()
+        if result & SAMPLE:
+            self._publish_live()
+
+    def _calculate_buffer_stats(self):
+        if self._store.length == 0:
+            return
+        for feed_id in range(self._feed_count):
+            minimum, maximum, avg, stddev = self._store.stats(feed_id)
+            self._buffer_min[feed_id] = minimum
+            self._buffer_max[feed_id] = maximum
+            self._buffer_avg[feed_id] = avg
+            self._buffer_stddev[feed_id] = stddev
+            values = sorted(self._store.values(feed_id))
+            self._buffer_median[feed_id] = Aggregator._quantile(values, 0.5)
+            self._buffer_p90[feed_id] = Aggregator._quantile(values, 0.9)
+
+    def _publish_live(self):
+        self._store.read_averages(self._averages)
+        # Realtime, avg & stddev are sent in centiwatts, so the displays only deal with integers
+        avg = [int(round(value * 100)) for value in self._buffer_avg]
+        stddev = [int(round(value * 100)) for value in self._buffer_stddev]
+        frame = frames.pack_live(self._sampler.last_value_added, self._graph_interval, self._sampler.realtime,
+                                 self._averages, self._buffer_min, self._buffer_max, avg,
+                                 stddev, self._buffer_median, self._buffer_p90)
+        self._mqtt.publish(self._live_topic, frame, retain=True)
+
+    def _publish_history(self):
+        frame = frames.pack_history(self._sampler.last_value_added, self._graph_interval, self._store)
+        self._mqtt.publish(self._history_topic, frame, retain=True)
+
+    @staticmethod
+    def _quantile(sorted_values, fraction):
+        return sorted_values[int(round(fraction * (len(sorted_values) - 1)))]
+
+
+if __name__ == '__main__':
+    with open(sys.argv[1] if len(sys.argv) > 1 else 'config.json', 'r') as f:
+        config = json.load(f)
+
+    extra_kwargs = {}
+    for key in ['graph_interval_s', 'feeds', 'backfill']:
+        if key in config:
+            extra_kwargs[key] = config[key]
+
+    Aggregator(solar_topic=config['solar_topic'],
+               grid_topic=config['grid_topic'],
+               mqtt_broker=config['mqtt_broker'],
+               aggregator_topic=config.get('aggregator_topic', 'solar_display'),
+               **extra_kwargs).run()
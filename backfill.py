@@ -0,0 +1,175 @@
+# Solar display - Showing solar/energy production/consumption on an M5Stack
+# Copyright (C) 2020 - Kenneth Henderick <kenneth@ketronic.be>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+try:
+    import usocket as socket
+except ImportError:
+    import socket
+
+
+class FeedDataParser(object):
+    """
+    Incremental parser for emoncms `feed/data.json` responses (`[[time_ms, value], ...]`). Bytes
+    can be fed in chunks of any size, every complete pair is passed to `callback(time_ms, value)`.
+    Values are `None` when emoncms reports `null`.
+    """
+
+    def __init__(self, callback):
+        self._callback = callback
+        self._depth = 0
+        self._field = 0
+        self._timestamp = None
+        self._value = None
+        self._reset_token()
+
+    def _reset_token(self):
+        self._active = False
+        self._null = False
+        self._negative = False
+        self._mantissa = 0
+        self._decimals = -1  # Amount of digits after the decimal point, -1 if there is none
+        self._in_exponent = False
+        self._exponent_negative = False
+        self._exponent = 0
+
+    def _end_token(self):
+        if not self._active:
+            return
+        if self._null:
+            value = None
+        else:
+            exponent = -self._exponent if self._exponent_negative else self._exponent
+            if self._decimals > 0:
+                exponent -= self._decimals
+            value = self._mantissa
+            if exponent != 0 or self._decimals >= 0:
+                value = value * 10.0 ** exponent
+            if self._negative:
+                value = -value
+        if self._field == 0:
+            self._timestamp = value
+        else:
+            self._value = value
+        self._reset_token()
+
+    def feed(self, data, start=0, end=None):
+        if end is None:
+            end = len(data)
+        for index in range(start, end):
+            char = data[index]
+            if 48 <= char <= 57:  # 0-9
+                if self._in_exponent:
+                    self._exponent = self._exponent * 10 + char - 48
+                else:
+                    self._mantissa = self._mantissa * 10 + char - 48
+                    if self._decimals >= 0:
+                        self._decimals += 1
+                self._active = True
+            elif char == 44:  # ,
+                self._end_token()
+                self._field += 1
+            elif char == 91:  # [
+                self._depth += 1
+                self._field = 0
+            elif char == 93:  # ]
+                self._end_token()
+                if self._depth == 2 and self._field == 1 and self._timestamp is not None:
+                    self._callback(self._timestamp, self._value)
+                self._timestamp = None
+                self._value = None
+                self._depth -= 1
+            elif char == 46:  # .
+                self._decimals = 0
+            elif char == 45:  # -
+                if self._in_exponent:
+                    self._exponent_negative = True
+                else:
+                    self._negative = True
+            elif char == 101 or char == 69:  # e/E
+                self._in_exponent = True
+            elif char == 110:  # n(ull)
+                self._null = True
+                self._active = True
+
+
+def fetch(url, path, callback, chunk_size=256):
+    """
+    Performs a HTTP GET on `url` + `path`, passing the response body in chunks to
+    `callback(data, start, end)`. Only a single `chunk_size` buffer is used.
+    """
+    if url.startswith('http://'):
+        url = url[7:]
+    host, _, base_path = url.partition('/')
+    port = 80
+    if ':' in host:
+        host, port = host.split(':')
+        port = int(port)
+    base_path = base_path.strip('/')
+    if base_path:
+        path = '/{0}{1}'.format(base_path, path)
+    request = 'GET {0} HTTP/1.0\r\nHost: {1}\r\n\r\n'.format(path, host)
+
+    sock = socket.socket()
+    try:
+        sock.settimeout(10)
+        sock.connect(socket.getaddrinfo(host, port)[0][-1])
+        sock.send(request.encode())
+        readinto = getattr(sock, 'readinto', None) or sock.recv_into
+        buffer = bytearray(chunk_size)
+        status = bytearray(12)  # `HTTP/1.x 200`
+        received = 0
+        header_match = 0  # Progress through the `\r\n\r\n` header terminator
+        while True:
+            length = readinto(buffer)
+            if not length:
+                break
+            start = 0
+            if header_match < 4:
+                while start < length and header_match < 4:
+                    char = buffer[start]
+                    if received < 12:
+                        status[received] = char
+                    received += 1
+                    if char == (13 if header_match % 2 == 0 else 10):
+                        header_match += 1
+                    else:
+                        header_match = 1 if char == 13 else 0
+                    start += 1
+                if header_match == 4 and status[9:12] != b'200':
+                    raise OSError('HTTP status {0}'.format(bytes(status[9:12]).decode()))
+            if start < length:
+                callback(buffer, start, length)
+    finally:
+        sock.close()
+
+
+def fill(store, feed_id, url, apikey, emoncms_id, start, count, interval):
+    """
+    Streams `count` buckets of `interval` seconds from an emoncms feed, starting at `start`,
+    straight into the last `count` rows of the store's column for `feed_id`.
+    """
+    first = store.length - count
+
+    def _write(timestamp, value):
+        if value is None:
+            return
+        bucket = int(timestamp / 1000 - start) // interval
+        if 0 <= bucket < count:
+            store.write(feed_id, first + bucket, value)
+
+    path = '/feed/data.json?id={0}&start={1}&end={2}&interval={3}&average=1&skipmissing=0&apikey={4}'.format(
+        emoncms_id, start * 1000, (start + count * interval) * 1000, interval, apikey
+    )
+    fetch(url, path, FeedDataParser(_write).feed)
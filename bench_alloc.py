@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# Solar display - Showing solar/energy production/consumption on an M5Stack
+# Copyright (C) 2020 - Kenneth Henderick <kenneth@ketronic.be>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+Host allocation benchmark for the hot paths that run on every MQTT message or display tick.
+It first checks that those paths return the right values, then measures the heap bytes allocated
+per call. It exits with status 1 if a check fails or a path goes over its allocation budget.
+
+Usage: micropython bench_alloc.py
+
+Run it with the MicroPython unix port; that's the allocator the display uses. Under CPython
+(python3 bench_alloc.py) the numbers come from tracemalloc and are only reported, since CPython
+allocates for things MicroPython doesn't (e.g. every int above 256).
+"""
+import sys
+import gc
+from feeds import FeedStore, FeedSampler, parse_centi, SOLAR, GRID, USAGE, FIRST_EXTRA, SAMPLE, BUCKET
+from httpserver import write_csv_row
+from glyphs import Readout, CENTER
+
+CALLS = 1000
+MICROPYTHON = sys.implementation.name == 'micropython'
+
+
+class _NullGlyphCache(object):
+    """ Stands in for the display bound GlyphCache, so only the readout's own work is measured """
+    width = 8
+
+    def blit(self, x, y, char, color):
+        pass
+
+
+def check():
+    """ Returns the amount of failed correctness checks; these are enforced on every implementation """
+    failed = 0
+    for text, expected in (('12', 1200), (b'-200', -20000), ('1234.56', 123456), (b'-87.5', -8750),
+                           ('0.07', 7), ('12.345', 1234), ('7.', 700), (' 3\n', 300)):
+        actual = parse_centi(text)
+        if actual != expected:
+            print('parse_centi({0!r}) = {1}, expected {2}'.format(text, actual, expected))
+            failed += 1
+    for text in ('', b'', '-', '.', 'abc'):
+        try:
+            parse_centi(text)
+            print('parse_centi({0!r}) did not raise ValueError'.format(text))
+            failed += 1
+        except ValueError:
+            pass
+
+    store = FeedStore(FIRST_EXTRA + 1)
+    sampler = FeedSampler(store, 60)
+    # time, feed id, value (centiwatts), expected result, expected realtime solar/grid/usage
+    steps = ((60, SOLAR, 100075, 0, (100075, 0, 0)),
+             (61, GRID, -20050, SAMPLE, (100075, -20050, 80025)),
+             (62, SOLAR, -300, 0, (0, -20050, 80025)),  # Solar is never negative
+             (120, GRID, 1000, SAMPLE | BUCKET, (0, 1000, 1000)))
+    for now, feed_id, value, expected, realtime in steps:
+        result = sampler.process(feed_id, value, now)
+        actual = (sampler.realtime[SOLAR], sampler.realtime[GRID], sampler.realtime[USAGE])
+        if result != expected or actual != realtime:
+            print('FeedSampler.process at {0}: {1} {2}, expected {3} {4}'.format(now, result, actual, expected, realtime))
+            failed += 1
+    sampler.process(FIRST_EXTRA, 25099, 121)
+    # The completed bucket holds the truncated watt averages: solar (1000 + 0) / 2, grid (-200 + 10) / 2
+    expected = [500, -95, 405, 0]
+    row = [0] * store.feed_count
+    if store.length == 1:
+        store.read_row(0, row)
+    if store.length != 1 or row != expected:
+        print('FeedStore after one bucket: {0} rows, {1}, expected 1 row, {2}'.format(store.length, row, expected))
+        failed += 1
+    store.read_averages(row)
+    if row[FIRST_EXTRA] != 250:
+        print('Extra feed bucket average: {0}, expected 250'.format(row[FIRST_EXTRA]))
+        failed += 1
+    return failed
+
+
+def measure(function):
+    """ Returns the amount of bytes allocated per call (MicroPython) or the peak amount of traced bytes (CPython) """
+    function(0)  # Warm up (e.g. interning, method caches)
+    function(1)
+    if MICROPYTHON:
+        gc.collect()
+        gc.disable()
+        start = gc.mem_alloc()
+        for index in range(CALLS):
+            function(index)
+        allocated = gc.mem_alloc() - start
+        gc.enable()
+        return allocated // CALLS
+    import tracemalloc
+    tracemalloc.start()
+    for index in range(CALLS):
+        function(index)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def main():
+    store = FeedStore(FIRST_EXTRA + 1)
+    sampler = FeedSampler(store, 60)
+    row = [0] * store.feed_count
+    line = bytearray(96)
+    values = [0] * 5
+    readout = Readout(_NullGlyphCache(), 0, 14, 10, CENTER)
+    for index in range(store.size):
+        row[SOLAR] = index * 10
+        row[GRID] = 500 - index
+        store.append(row)
+
+    def parse_str(index):
+        parse_centi('1234.56' if index % 2 else '-87.5')
+
+    def parse_bytes(index):
+        parse_centi(b'1234.56' if index % 2 else b'-87.5')
+
+    def process(index):
+        sampler.process(index % 2, 123456 - index, 1000 + index)  # A bucket is completed every 60 calls
+
+    def process_extra(index):
+        sampler.process(FIRST_EXTRA, 5000 + index, 1000 + index)
+
+    def read_averages(index):
+        store.read_averages(row)
+
+    def read_row(index):
+        store.read_row(index % store.length, row)
+
+    def csv_row(index):
+        values[0] = index
+        values[1] = -index
+        write_csv_row(line, values, 5, label=b'solar')
+
+    def draw_readout(index):
+        readout.draw(123456 - index * 7, 0)
+
+    # Path name, function, budget in bytes per call
+    paths = [('parse_centi (str)', parse_str, 0),
+             ('parse_centi (bytes)', parse_bytes, 0),
+             ('FeedSampler.process', process, 0),
+             ('FeedSampler.process (extra feed)', process_extra, 0),
+             ('FeedStore.read_averages', read_averages, 0),
+             ('FeedStore.read_row', read_row, 0),
+             ('write_csv_row', csv_row, 0),
+             ('Readout.draw', draw_readout, 0)]
+    failed = check() > 0
+    unit = 'bytes/call' if MICROPYTHON else 'bytes peak'
+    for name, function, budget in paths:
+        allocated = measure(function)
+        over = MICROPYTHON and allocated > budget
+        failed = failed or over
+        print('{0:<36} {1:>6} {2}{3}'.format(name, allocated, unit, ' OVER BUDGET ({0})'.format(budget) if over else ''))
+    if not MICROPYTHON:
+        print('Not running on MicroPython, budgets are not enforced')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -14,6 +14,9 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 import os
+import ujson
+import uhashlib
+import ubinascii
 from machine import Pin
 
 SD_FOLDER = '/sd'
@@ -21,11 +24,84 @@ FLASH_FOLDER = '/flash'
 UPDATE_FOLDER = '{0}/update'.format(SD_FOLDER)
 FLASH_FILE = '{0}/{{0}}'.format(FLASH_FOLDER)
 UPDATE_FILE = '{0}/{{0}}'.format(UPDATE_FOLDER)
+STAGING_FILE = '{0}.new'
 BACKUP_FILE = 'backup.json'
 RUNTIME_CONFIG_FILE = 'runtime_config.json'
+MANIFEST_FILE = 'manifest.json'  # Maps filenames to their sha256 hash, both on the SD card and on flash
+COMMIT_FILE = 'update_commit.json'  # Present while verified, staged files are being swapped in
+UNMANAGED_FILES = [BACKUP_FILE, RUNTIME_CONFIG_FILE, MANIFEST_FILE, COMMIT_FILE]  # Never updated, removed or listed in a manifest
+
+_buffer = bytearray(512)
+
+
+def _exists(path):
+    try:
+        os.stat(path)
+        return True
+    except OSError:
+        return False
+
+
+def _load_json(path):
+    if not _exists(path):
+        return None
+    with open(path, 'r') as f:
+        return ujson.load(f)
+
+
+def _replace(source, destination):
+    if _exists(destination):
+        os.remove(destination)
+    os.rename(source, destination)
+
+
+def _write_json(path, data):
+    staged = STAGING_FILE.format(path)
+    with open(staged, 'w') as f:
+        f.write(ujson.dumps(data))
+    _replace(staged, path)
+
+
+def _copy_file(source_path, destination_path=None):
+    """ Copies a file in fixed size chunks (or only reads it if there's no destination), returns the sha256 """
+    digest = uhashlib.sha256()
+    view = memoryview(_buffer)
+    destination = None if destination_path is None else open(destination_path, 'wb')
+    try:
+        with open(source_path, 'rb') as source:
+            while True:
+                length = source.readinto(_buffer)
+                if not length:
+                    break
+                digest.update(view[:length])
+                if destination is not None:
+                    destination.write(view[:length])
+    finally:
+        if destination is not None:
+            destination.close()
+    return ubinascii.hexlify(digest.digest()).decode()
+
+
+def _finish_update():
+    """ Swaps in the staged files of a verified update. Safe to repeat when interrupted """
+    commit = _load_json(FLASH_FILE.format(COMMIT_FILE))
+    if commit is None:
+        return
+    for filename in commit['files']:
+        staged = FLASH_FILE.format(STAGING_FILE.format(filename))
+        if _exists(staged):
+            _replace(staged, FLASH_FILE.format(filename))
+            print('- updated {0}'.format(filename))
+    for filename in commit['removed']:
+        if _exists(FLASH_FILE.format(filename)):
+            os.remove(FLASH_FILE.format(filename))
+            print('- removed {0}'.format(filename))
+    _write_json(FLASH_FILE.format(MANIFEST_FILE), commit['manifest'])
+    os.remove(FLASH_FILE.format(COMMIT_FILE))
 
 
 def _try_update():
+    _finish_update()
     os.sdconfig(os.SDMODE_SPI, clk=Pin(18), mosi=Pin(23), miso=Pin(19), cs=Pin(4))
     try:
         os.mountsd()
@@ -38,22 +114,52 @@ def _try_update():
         print('No update folder found')
         return
     print('Update folder found. Updating...')
-    for filename in os.listdir(FLASH_FOLDER):
-        if filename in [BACKUP_FILE, RUNTIME_CONFIG_FILE]:
-            continue
-        os.remove(filename)
-        print('- removed {0}'.format(filename))
-    for filename in os.listdir(UPDATE_FOLDER):
-        with open(UPDATE_FILE.format(filename), 'r') as source:
-            content = '\n'.join(source.readlines())
-        with open(FLASH_FILE.format(filename), 'w') as destination:
-            destination.write(content)
-        print('- added {0}'.format(filename))
+    filenames = [filename for filename in os.listdir(UPDATE_FOLDER) if filename not in UNMANAGED_FILES]
+    manifest = _load_json(UPDATE_FILE.format(MANIFEST_FILE))
+    if manifest is None:
+        print('- no manifest found, hashing update files')
+        manifest = {}
+        for filename in filenames:
+            manifest[filename] = _copy_file(UPDATE_FILE.format(filename))
+    else:
+        manifest = {filename: manifest[filename] for filename in manifest if filename not in UNMANAGED_FILES}
+    installed = _load_json(FLASH_FILE.format(MANIFEST_FILE)) or {}
+    flash_files = os.listdir(FLASH_FOLDER)
+
+    # Stage and verify all changed files, the current files stay untouched until everything checks out
+    changed = []
+    for filename in manifest:
+        expected = manifest[filename]
+        if filename in flash_files:
+            current = installed.get(filename) or _copy_file(FLASH_FILE.format(filename))
+            if current == expected:
+                continue
+        staged = FLASH_FILE.format(STAGING_FILE.format(filename))
+        changed.append(filename)
+        try:
+            verified = _copy_file(UPDATE_FILE.format(filename), staged) == expected and _copy_file(staged) == expected
+        except OSError as ex:
+            print('- could not copy {0}: {1}'.format(filename, ex))  # E.g. listed in the manifest, but missing
+            verified = False
+        if not verified:
+            print('- verification of {0} failed. Update aborted'.format(filename))
+            for staged_filename in changed:
+                staged = FLASH_FILE.format(STAGING_FILE.format(staged_filename))
+                if _exists(staged):
+                    os.remove(staged)
+            os.umountsd()
+            return
+        print('- staged {0}'.format(filename))
+    removed = [filename for filename in installed
+               if filename not in manifest and filename not in UNMANAGED_FILES and filename in flash_files]
+
+    _write_json(FLASH_FILE.format(COMMIT_FILE), {'files': changed, 'removed': removed, 'manifest': manifest})
+    _finish_update()
     for filename in os.listdir(UPDATE_FOLDER):
         os.remove(UPDATE_FILE.format(filename))
     os.rmdir(UPDATE_FOLDER)
     os.umountsd()
-    print('Update completed')
+    print('Update completed ({0} changed, {1} removed)'.format(len(changed), len(removed)))
 
 
 _try_update()
@@ -0,0 +1,262 @@
+# Solar display - Showing solar/energy production/consumption on an M5Stack
+# Copyright (C) 2020 - Kenneth Henderick <kenneth@ketronic.be>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+from array import array
+from math import sqrt
+
+# Fixed feed ids. Usage is derived (solar + grid), every configured extra
+# feed (battery, EV charger, heat pump, ...) gets an id starting at FIRST_EXTRA.
+SOLAR = 0
+GRID = 1
+USAGE = 2
+FIRST_EXTRA = 3
+
+# Results of FeedSampler.process()
+SAMPLE = 1  # A paired solar & grid sample was completed
+BUCKET = 2  # A graph bucket was completed
+
+
+def parse_centi(text):
+    """ Parses a decimal number (str or bytes) into hundredths, without allocating floats """
+    is_str = isinstance(text, str)
+    value = 0
+    negative = False
+    digits = False
+    decimals = -1  # Amount of digits after the decimal point, -1 if there is none
+    for index in range(len(text)):
+        char = ord(text[index]) if is_str else text[index]
+        if 48 <= char <= 57:  # 0-9
+            digits = True
+            if decimals < 2:  # Further digits are truncated
+                value = value * 10 + char - 48
+                if decimals >= 0:
+                    decimals += 1
+        elif char == 46:  # .
+            decimals = 0
+        elif char == 45:  # -
+            negative = True
+        elif char != 32 and char != 10 and char != 13:
+            raise ValueError('Invalid number')
+    if not digits:
+        raise ValueError('Invalid number')
+    if decimals < 0:
+        decimals = 0
+    while decimals < 2:
+        value *= 10
+        decimals += 1
+    return -value if negative else value
+
+
+def truncate_centi(value):
+    """ Converts hundredths to whole units, truncating towards zero like int() """
+    return -(-value // 100) if value < 0 else value // 100
+
+
+def build_registry(solar_topic, grid_topic, feeds):
+    """ Returns the topic to feed id mapping, the feed names and the feed color names, indexed by feed id """
+    feed_ids = {solar_topic: SOLAR, grid_topic: GRID}
+    names = ['solar', 'grid', 'usage']
+    colors = ['YELLOW', 'RED', 'BLUE']
+    for feed in feeds or []:
+        feed_ids[feed['topic']] = len(names)
+        names.append(feed['name'])
+        colors.append(feed.get('color', 'MAGENTA'))
+    return feed_ids, names, colors
+
+
+class FeedStore(object):
+    """ Columnar ring buffer, holding one packed array per feed """
+
+    def __init__(self, feed_count, size=319):
+        self.feed_count = feed_count
+        self.size = size
+        self.length = 0
+        self.head = 0  # Position where the next row will be written
+        self.changes = 0  # Increased on every change to the stored rows, so readers can tell they changed
+        self.columns = [array('i', [0] * size) for _ in range(feed_count)]
+        self._sums = array('i', [0] * feed_count)
+        self._counts = array('i', [0] * feed_count)
+
+    def position(self, index):
+        """ Converts a chronological index (0 = oldest) into a position in the columns """
+        position = self.head - self.length + index
+        if position < 0:
+            position += self.size
+        return position
+
+    def accumulate(self, feed_id, value):
+        """ Adds a sample to the bucket that is currently being collected """
+        self._sums[feed_id] += int(value)
+        self._counts[feed_id] += 1
+
+    def read_averages(self, target):
+        """ Writes the averages of the current bucket into `target`, indexed by feed id """
+        sums = self._sums
+        counts = self._counts
+        for feed_id in range(self.feed_count):
+            count = counts[feed_id]
+            if count == 0:
+                target[feed_id] = 0
+            else:
+                total = sums[feed_id]  # Integer division, truncating towards zero like int()
+                target[feed_id] = -(-total // count) if total < 0 else total // count
+        if counts[SOLAR] == 0 or counts[GRID] == 0:
+            target[SOLAR] = 0
+            target[GRID] = 0
+        target[USAGE] = target[SOLAR] + target[GRID]
+
+    def commit(self, row):
+        """ Closes the current bucket; its averages are appended (via `row`) and the bucket is reset """
+        self.read_averages(row)
+        self.append(row)
+        self.clear_bucket()
+
+    def clear_bucket(self):
+        for feed_id in range(self.feed_count):
+            self._sums[feed_id] = 0
+            self._counts[feed_id] = 0
+
+    def append(self, row):
+        head = self.head
+        for feed_id in range(self.feed_count):
+            self.columns[feed_id][head] = row[feed_id]
+        self.head = (head + 1) % self.size
+        if self.length < self.size:
+            self.length += 1
+        self.changes += 1
+
+    def extend(self, count):
+        """ Appends `count` empty rows """
+        for _ in range(count):
+            for feed_id in range(self.feed_count):
+                self.columns[feed_id][self.head] = 0
+            self.head = (self.head + 1) % self.size
+            if self.length < self.size:
+                self.length += 1
+        self.changes += 1
+
+    def write(self, feed_id, index, value):
+        """ Overwrites a single value at chronological `index` """
+        self.columns[feed_id][self.position(index)] = int(value)
+        self.changes += 1
+
+    def recalculate_usage(self, start):
+        """ Derives usage (solar + grid) for all rows starting at chronological `start` """
+        solar_column = self.columns[SOLAR]
+        grid_column = self.columns[GRID]
+        usage_column = self.columns[USAGE]
+        for index in range(start, self.length):
+            position = self.position(index)
+            solar = max(0, solar_column[position])
+            solar_column[position] = solar
+            usage_column[position] = solar + grid_column[position]
+        self.changes += 1
+
+    def read_row(self, index, target):
+        """ Writes the values at chronological `index` into `target`, indexed by feed id """
+        position = self.position(index)
+        for feed_id in range(self.feed_count):
+            target[feed_id] = self.columns[feed_id][position]
+
+    def values(self, feed_id):
+        """ Returns a feed's values as a list, oldest first """
+        column = self.columns[feed_id]
+        return [column[self.position(index)] for index in range(self.length)]
+
+    def restore(self, buffers):
+        """ Loads lists of values (oldest first, indexed by feed id, `None` if unknown) """
+        length = 0
+        for values in buffers:
+            if values:
+                length = max(length, len(values))
+        length = min(length, self.size)
+        for feed_id in range(self.feed_count):
+            values = buffers[feed_id] if feed_id < len(buffers) and buffers[feed_id] else []
+            column = self.columns[feed_id]
+            offset = len(values) - length
+            for index in range(length):
+                column[index] = int(values[offset + index]) if offset + index >= 0 else 0
+        self.length = length
+        self.head = length % self.size
+        self.changes += 1
+
+    def stats(self, feed_id):
+        """ Returns min, max, avg and stddev of a feed in a single pass """
+        column = self.columns[feed_id]
+        length = self.length
+        if length == 0:
+            return 0, 0, 0, 0
+        minimum = maximum = column[0]
+        total = 0
+        squares = 0
+        for position in range(length):
+            value = column[position]
+            if value < minimum:
+                minimum = value
+            if value > maximum:
+                maximum = value
+            total += value
+            squares += value * value
+        avg = total / length
+        return minimum, maximum, avg, sqrt(max(0.0, squares / length - avg * avg))
+
+
+class FeedSampler(object):
+    """
+    Pairs solar & grid samples into realtime usage, and averages every feed into graph buckets.
+    Realtime values are kept in hundredths (e.g. centiwatts), so no floats are needed.
+    """
+
+    def __init__(self, store, graph_interval):
+        self.store = store
+        self.graph_interval = graph_interval
+        self.realtime = array('i', [0] * store.feed_count)
+        self.last_value_added = None  # Start of the bucket that is currently being collected
+        self.remaining = 0  # Seconds until the current bucket is completed
+        self._received = 0  # Bitmask of the feed ids received since the last paired sample
+        self._row = [0] * store.feed_count
+
+    def process(self, feed_id, value, now):
+        """ Processes a sample (in hundredths, see parse_centi), returns a combination of SAMPLE and BUCKET """
+        if feed_id == SOLAR and value < 0:
+            value = 0
+        self.realtime[feed_id] = value
+
+        if feed_id >= FIRST_EXTRA:
+            # Extra feeds are not paired, they're averaged into the current bucket as they come in
+            self.store.accumulate(feed_id, truncate_centi(value))
+            return 0
+
+        self._received |= 1 << feed_id
+        if self._received != (1 << SOLAR) | (1 << GRID):
+            return 0
+        # Once the data has been received, calculate realtime usage
+        self._received = 0
+        realtime = self.realtime
+        realtime[USAGE] = realtime[SOLAR] + realtime[GRID]
+
+        # Process data for the graph; collect solar & grids, and every x-pixel
+        # average the data out and draw them on that pixel.
+        rounded_now = int(now - now % self.graph_interval)
+        if self.last_value_added is None:
+            self.last_value_added = rounded_now
+        self.remaining = int(rounded_now + self.graph_interval - now)
+        self.store.accumulate(SOLAR, truncate_centi(realtime[SOLAR]))
+        self.store.accumulate(GRID, truncate_centi(realtime[GRID]))
+        if self.last_value_added == rounded_now:
+            return SAMPLE
+        self.store.commit(self._row)
+        self.last_value_added = rounded_now
+        return SAMPLE | BUCKET
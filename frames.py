@@ -0,0 +1,112 @@
+# Solar display - Showing solar/energy production/consumption on an M5Stack
+# Copyright (C) 2020 - Kenneth Henderick <kenneth@ketronic.be>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+Binary frames published by the aggregator. All values are little-endian.
+
+Every frame starts with a header: magic (`S`), frame type, feed count, a padding byte,
+the start of the bucket being collected (int32) and the graph interval in seconds (int32).
+
+* LIVE frames add, per feed, int32 values: realtime (centiwatts), current bucket average,
+  graph min, max, avg (centiwatts), stddev (centiwatts), median and 90th percentile.
+* HISTORY frames add the graph length (uint16, padded to 4 bytes) followed by one int32
+  column per feed, oldest first. Usage is left out; it's derived (solar + grid) on reading.
+"""
+try:
+    import ustruct as struct
+except ImportError:
+    import struct
+from feeds import USAGE
+
+MAGIC = 0x53
+LIVE = 1
+HISTORY = 2
+
+_HEADER = '<BBBBii'
+_HEADER_SIZE = struct.calcsize(_HEADER)
+_LIVE_FEED = '<iiiiiiii'
+_LIVE_VALUES = 8
+_LIVE_FEED_SIZE = struct.calcsize(_LIVE_FEED)
+_HISTORY_LENGTH = '<HH'
+_HISTORY_LENGTH_SIZE = struct.calcsize(_HISTORY_LENGTH)
+
+
+def pack_live(timestamp, interval, realtime, averages, minimum, maximum, avg, stddev, median, p90):
+    """ Builds a LIVE frame; all value arguments are sequences indexed by feed id """
+    feed_count = len(realtime)
+    frame = bytearray(_HEADER_SIZE + feed_count * _LIVE_FEED_SIZE)
+    struct.pack_into(_HEADER, frame, 0, MAGIC, LIVE, feed_count, 0, timestamp, interval)
+    for feed_id in range(feed_count):
+        struct.pack_into(_LIVE_FEED, frame, _HEADER_SIZE + feed_id * _LIVE_FEED_SIZE,
+                         realtime[feed_id], averages[feed_id], minimum[feed_id], maximum[feed_id],
+                         avg[feed_id], stddev[feed_id], median[feed_id], p90[feed_id])
+    return bytes(frame)
+
+
+def pack_history(timestamp, interval, store):
+    """ Builds a HISTORY frame holding the complete contents of a FeedStore """
+    offset = _HEADER_SIZE + _HISTORY_LENGTH_SIZE
+    frame = bytearray(offset + (store.feed_count - 1) * store.length * 4)
+    struct.pack_into(_HEADER, frame, 0, MAGIC, HISTORY, store.feed_count, 0, timestamp, interval)
+    struct.pack_into(_HISTORY_LENGTH, frame, _HEADER_SIZE, store.length, 0)
+    for feed_id in range(store.feed_count):
+        if feed_id == USAGE:
+            continue
+        for value in store.values(feed_id):
+            struct.pack_into('<i', frame, offset, value)
+            offset += 4
+    return bytes(frame)
+
+
+def read_header(frame):
+    """ Returns frame type, feed count, bucket timestamp and graph interval """
+    magic, frame_type, feed_count, _, timestamp, interval = struct.unpack_from(_HEADER, frame, 0)
+    if magic != MAGIC:
+        raise ValueError('Invalid frame')
+    return frame_type, feed_count, timestamp, interval
+
+
+def read_live_into(frame, feed_id, values):
+    """
+    Reads the values of a single feed from a LIVE frame into `values` (a list of 8), in the order
+    described above. The int32s are decoded by hand, so there's no tuple (or bigint, as long as
+    the values fit a small int) allocated.
+    """
+    offset = _HEADER_SIZE + feed_id * _LIVE_FEED_SIZE
+    for index in range(_LIVE_VALUES):
+        top = frame[offset + 3]
+        if top >= 128:
+            top -= 256
+        values[index] = (top << 24) + (frame[offset + 2] << 16) + (frame[offset + 1] << 8) + frame[offset]
+        offset += 4
+
+
+def read_history(frame, store):
+    """ Loads a HISTORY frame into a FeedStore, replacing its contents """
+    frame_length = struct.unpack_from(_HISTORY_LENGTH, frame, _HEADER_SIZE)[0]
+    length = min(frame_length, store.size)
+    column_format = '<{0}i'.format(length)
+    offset = _HEADER_SIZE + _HISTORY_LENGTH_SIZE + (frame_length - length) * 4  # Skip the oldest values if needed
+    for feed_id in range(store.feed_count):
+        if feed_id == USAGE:
+            continue
+        column = store.columns[feed_id]
+        values = struct.unpack_from(column_format, frame, offset)
+        for index in range(length):
+            column[index] = values[index]
+        offset += frame_length * 4
+    store.length = length
+    store.head = length % store.size
+    store.recalculate_usage(0)
@@ -0,0 +1,156 @@
+# Solar display - Showing solar/energy production/consumption on an M5Stack
+# Copyright (C) 2020 - Kenneth Henderick <kenneth@ketronic.be>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Display (ILI9341) commands used to blit a sprite
+_COLUMN_ADDRESS_SET = 0x2A
+_PAGE_ADDRESS_SET = 0x2B
+_MEMORY_WRITE = 0x2C
+
+_CHARACTERS = b'0123456789.W-'
+_BLANK = 32  # A space, drawn as an empty cell
+_NOT_DRAWN = 0
+_MIN_SLOTS = 6  # Enough for `-0.00W`
+
+LEFT = 0
+CENTER = 1
+RIGHT = 2
+
+
+class GlyphCache(object):
+    """
+    Glyphs rendered once per color by the font engine and read back from the display, so they can
+    be blitted afterwards. Every glyph gets a cell of the same width, centered in it. Sprites are
+    kept in the format the display returns (3 bytes per pixel), which is also what it's written in.
+    """
+
+    def __init__(self, tft, colors, x, y):
+        self._tft = tft
+        self.width = 0
+        for char in _CHARACTERS:
+            self.width = max(self.width, tft.textWidth(chr(char)))
+        self.height = tft.fontSize()[1]
+        self._index = bytearray(128)  # Character to glyph index + 1
+        for index, char in enumerate(_CHARACTERS):
+            self._index[char] = index + 1
+        self._sprites = {}
+        self._blank = self._render(x, y, None, None)
+        for color in colors:
+            self._sprites[color] = [self._render(x, y, chr(char), color) for char in _CHARACTERS]
+        tft.rect(x, y, self.width, self.height, tft.BLACK, tft.BLACK)
+        self._columns = bytearray(4)
+        self._pages = bytearray(4)
+
+    def _render(self, x, y, text, color):
+        tft = self._tft
+        tft.rect(x, y, self.width, self.height, tft.BLACK, tft.BLACK)
+        if text is not None:
+            tft.text(x + (self.width - tft.textWidth(text)) // 2, y, text, color)
+        sprite = bytearray(self.width * self.height * 3)
+        tft.readScreen(x, y, self.width, self.height, sprite)
+        return sprite
+
+    def blit(self, x, y, char, color):
+        """ Draws a single character (one of `0-9.W-` or a space) with its top left corner at x, y """
+        index = self._index[char]
+        sprite = self._blank if index == 0 else self._sprites[color][index - 1]
+        columns = self._columns
+        pages = self._pages
+        end_x = x + self.width - 1
+        end_y = y + self.height - 1
+        columns[0] = x >> 8
+        columns[1] = x & 0xFF
+        columns[2] = end_x >> 8
+        columns[3] = end_x & 0xFF
+        pages[0] = y >> 8
+        pages[1] = y & 0xFF
+        pages[2] = end_y >> 8
+        pages[3] = end_y & 0xFF
+        self._tft.tft_writecmddata(_COLUMN_ADDRESS_SET, columns)
+        self._tft.tft_writecmddata(_PAGE_ADDRESS_SET, pages)
+        self._tft.tft_writecmddata(_MEMORY_WRITE, sprite)
+
+
+class Readout(object):
+    """
+    A value in hundredths, shown as `[-]x.xxW` in a fixed amount of glyph cells (all dashes if it doesn't fit);
+    only changed cells are redrawn
+    """
+
+    def __init__(self, cache, x, y, slots, align=LEFT):
+        if slots < _MIN_SLOTS:
+            raise ValueError('A readout needs at least {0} cells, got {1}'.format(_MIN_SLOTS, slots))
+        self._cache = cache
+        self._x = x
+        self._y = y
+        self._slots = slots
+        self._align = align
+        self._text = bytearray(slots)
+        self._drawn = bytearray(slots)  # Characters currently on the display, per cell
+        self._drawn_color = None
+
+    def invalidate(self):
+        """ Makes sure every cell is redrawn, e.g. after something else was drawn over the readout """
+        for slot in range(self._slots):
+            self._drawn[slot] = _NOT_DRAWN
+
+    def draw(self, value, color):
+        """ Shows `value`, returns the amount of cells that were redrawn """
+        text = self._text
+        position = self._slots - 1  # The text is formatted right to left
+        text[position] = 87  # W
+        magnitude = -value if value < 0 else value
+        for _ in range(2):
+            position -= 1
+            text[position] = 48 + magnitude % 10
+            magnitude //= 10
+        position -= 1
+        text[position] = 46  # .
+        while True:
+            position -= 1
+            text[position] = 48 + magnitude % 10
+            magnitude //= 10
+            if magnitude == 0 or position == 1:  # Keep room for the sign
+                break
+        if magnitude > 0:
+            # The value doesn't fit, show dashes rather than a wrong number
+            for position in range(self._slots - 1):
+                text[position] = 45  # -
+            position = 0
+        elif value < 0:
+            position -= 1
+            text[position] = 45  # -
+        length = self._slots - position
+        if self._align == LEFT:
+            offset = 0
+        elif self._align == RIGHT:
+            offset = self._slots - length
+        else:
+            offset = (self._slots - length) // 2
+
+        drawn = self._drawn
+        color_changed = color != self._drawn_color
+        redrawn = 0
+        for slot in range(self._slots):
+            if offset <= slot < offset + length:
+                char = text[slot - offset + position]
+            else:
+                char = _BLANK
+            if char != drawn[slot] or color_changed:
+                self._cache.blit(self._x + slot * self._cache.width, self._y, char, color)
+                drawn[slot] = char
+                redrawn += 1
+        self._drawn_color = color
+        return redrawn
@@ -0,0 +1,204 @@
+# Solar display - Showing solar/energy production/consumption on an M5Stack
+# Copyright (C) 2020 - Kenneth Henderick <kenneth@ketronic.be>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+try:
+    import usocket as socket
+    import uerrno as errno
+except ImportError:
+    import socket
+    import errno
+
+_NOT_FOUND = b'HTTP/1.0 404 Not Found\r\nConnection: close\r\n\r\n'
+
+
+def write_bytes(buffer, offset, data):
+    """ Copies `data` into `buffer` at `offset`, returns the new offset """
+    end = offset + len(data)
+    buffer[offset:end] = data
+    return end
+
+
+def write_int(buffer, offset, value):
+    """ Writes the decimal representation of `value` into `buffer` at `offset`, returns the new offset """
+    value = int(value)
+    if value < 0:
+        buffer[offset] = 45  # -
+        offset += 1
+        value = -value
+    start = offset
+    while True:
+        buffer[offset] = 48 + value % 10
+        offset += 1
+        value //= 10
+        if value == 0:
+            break
+    end = offset - 1
+    while start < end:  # Digits were written in reverse
+        buffer[start], buffer[end] = buffer[end], buffer[start]
+        start += 1
+        end -= 1
+    return offset
+
+
+def write_csv_row(buffer, values, count, label=None):
+    """ Writes a CSV line (an optional label, followed by `count` values) into `buffer`, returns its length """
+    offset = 0
+    if label is not None:
+        offset = write_bytes(buffer, offset, label)
+    for index in range(count):
+        if offset > 0:
+            buffer[offset] = 44  # ,
+            offset += 1
+        offset = write_int(buffer, offset, values[index])
+    buffer[offset] = 10  # \n
+    return offset + 1
+
+
+class _Client(object):
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.request = bytearray(64)  # Start of the request line, the remaining headers are discarded
+        self.received = 0
+        self.header_match = 0  # Progress through the `\r\n\r\n` header terminator
+        self.chunks = None
+        self.pending = None
+        self.offset = 0
+        self.idle = 0
+
+
+class HttpServer(object):
+    """
+    Small non-blocking HTTP/1.0 server. Every call to `poll()` does a bounded amount of work (at most
+    one read or one chunk written per client), so it can be driven from a timer next to the display.
+    Route handlers are generators yielding the response body in chunks of bytes (bytes, bytearray or
+    a byte memoryview); a chunk is completely sent before the next one is requested, so handlers can
+    reuse their buffers.
+    """
+
+    def __init__(self, port=80, max_clients=2, max_idle_polls=200):
+        self._port = port
+        self._max_clients = max_clients
+        self._max_idle_polls = max_idle_polls
+        self._routes = {}
+        self._clients = []
+        self._scratch = bytearray(128)
+        self._sock = None
+
+    def route(self, path, content_type, handler):
+        header = 'HTTP/1.0 200 OK\r\nContent-Type: {0}\r\nConnection: close\r\n\r\n'.format(content_type)
+        self._routes[path.encode()] = (header.encode(), handler)
+
+    def start(self):
+        self._sock = socket.socket()
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind(socket.getaddrinfo('0.0.0.0', self._port)[0][-1])
+        self._sock.listen(self._max_clients)
+        self._sock.setblocking(False)
+
+    def stop(self):
+        for client in self._clients:
+            client.sock.close()
+        self._clients = []
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    @property
+    def clients(self):
+        return len(self._clients)
+
+    def poll(self):
+        if self._sock is None:
+            return
+        if len(self._clients) < self._max_clients:
+            try:
+                sock, _ = self._sock.accept()
+                sock.setblocking(False)
+                self._clients.append(_Client(sock))
+            except OSError:
+                pass  # No pending connection
+        index = len(self._clients) - 1
+        while index >= 0:
+            client = self._clients[index]
+            try:
+                done = self._step(client)
+            except OSError as ex:
+                done = ex.args[0] != errno.EAGAIN
+            if done or client.idle > self._max_idle_polls:
+                client.sock.close()
+                self._clients.pop(index)
+            index -= 1
+
+    def _step(self, client):
+        """ Progresses a single client, returns `True` when it's done """
+        if client.chunks is None:
+            return self._read(client)
+        if client.pending is None:
+            try:
+                pending = memoryview(next(client.chunks))
+            except StopIteration:
+                return True
+            if getattr(pending, 'itemsize', 1) != 1:
+                # The offset counts bytes, so multi-byte views (e.g. of an array) are sent as bytes
+                pending = pending.cast('B')
+            client.pending = pending
+            client.offset = 0
+        client.idle += 1
+        sent = client.sock.send(client.pending[client.offset:])
+        if sent:
+            client.idle = 0
+            client.offset += sent
+            if client.offset >= len(client.pending):
+                client.pending = None
+        return False
+
+    def _read(self, client):
+        client.idle += 1
+        readinto = getattr(client.sock, 'readinto', None) or client.sock.recv_into
+        length = readinto(self._scratch)
+        if length is None:
+            return False  # No data available yet
+        if length == 0:
+            return True  # Connection closed before the request was complete
+        client.idle = 0
+        scratch = self._scratch
+        for index in range(length):
+            char = scratch[index]
+            if client.received < 64:
+                client.request[client.received] = char
+            client.received += 1
+            if char == (13 if client.header_match % 2 == 0 else 10):
+                client.header_match += 1
+            else:
+                client.header_match = 1 if char == 13 else 0
+            if client.header_match == 4:
+                client.chunks = self._respond(client)
+                break
+        return False
+
+    def _respond(self, client):
+        # Request line: `GET /path?query HTTP/1.x`
+        line = bytes(client.request[:min(client.received, 64)])
+        parts = line.split(b' ')
+        path = parts[1].split(b'?')[0] if len(parts) > 2 else b''
+        route = self._routes.get(path)
+        if route is None:
+            yield _NOT_FOUND
+            return
+        header, handler = route
+        yield header
+        for chunk in handler():
+            yield chunk
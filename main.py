@@ -13,6 +13,9 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import time
+_boot_ticks = time.ticks_us()
+
 import ujson
 import os
 from monitor import Monitor
@@ -21,7 +24,7 @@ with open('/flash/config.json', 'r') as f:
     config = ujson.load(f)
 
 extra_kwargs = {}
-for key in ['graph_interval_s', 'update_interval_ms']:
+for key in ['graph_interval_s', 'update_interval_ms', 'feeds', 'backfill', 'http_port', 'aggregator_topic']:
     if key in config:
         extra_kwargs[key] = config[key]
 
@@ -29,7 +32,8 @@ _monitor = Monitor(solar_topic=config['solar_topic'],
                    grid_topic=config['grid_topic'],
                    mqtt_broker=config['mqtt_broker'],
                    wifi_credentials=config['wifi_credentials'],
+                   boot_ticks=_boot_ticks,
                    **extra_kwargs)
 _monitor.load()
-_monitor.init()
-_monitor.run()
+_monitor.run()  # Shows the restored graph right away
+_monitor.init(background=True)  # Wifi, MQTT, NTP, ... come up while the display is already running
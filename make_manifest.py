@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+# Solar display - Showing solar/energy production/consumption on an M5Stack
+# Copyright (C) 2020 - Kenneth Henderick <kenneth@ketronic.be>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+Writes the `manifest.json` used by the SD card updater (see `boot.py`), holding the sha256
+hash of every file in the given update folder.
+
+Usage: python3 make_manifest.py /path/to/sd/update
+"""
+import hashlib
+import json
+import os
+import sys
+
+MANIFEST_FILE = 'manifest.json'
+# Files the updater leaves alone (see `UNMANAGED_FILES` in `boot.py`)
+UNMANAGED_FILES = ['backup.json', 'runtime_config.json', MANIFEST_FILE, 'update_commit.json']
+
+if __name__ == '__main__':
+    folder = sys.argv[1] if len(sys.argv) > 1 else '.'
+    manifest = {}
+    for filename in sorted(os.listdir(folder)):
+        path = os.path.join(folder, filename)
+        if filename in UNMANAGED_FILES or not os.path.isfile(path):
+            continue
+        digest = hashlib.sha256()
+        with open(path, 'rb') as source:
+            for chunk in iter(lambda: source.read(4096), b''):
+                digest.update(chunk)
+        manifest[filename] = digest.hexdigest()
+    with open(os.path.join(folder, MANIFEST_FILE), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    print('Wrote a manifest for {0} files'.format(len(manifest)))
@@ -14,16 +14,39 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 import display
-import network
+import gc
 import time
-import ubinascii
 import ujson
 import os
 import machine
-from math import sqrt
+import ustruct
 from machine import I2C, Pin, Timer, RTC, Neopixel
 from ip5306 import IP5306
 from buttons import ButtonA, ButtonB, ButtonC
+from glyphs import GlyphCache, Readout, LEFT, CENTER, RIGHT
+from feeds import FeedStore, FeedSampler, build_registry, parse_centi, truncate_centi, SOLAR, GRID, USAGE, FIRST_EXTRA, SAMPLE, BUCKET
+# Modules only needed once connected (network, ubinascii, backfill, httpserver) are imported where they're used
+frames = None  # Imported when connecting in aggregator mode
+
+# Menu pages
+_MENU_UPDATED = 0
+_MENU_BATTERY = 1
+_MENU_GRAPH = 2
+_MENU_STATS = 3
+_MENU_TIME = 4
+_MENU_EXCEPTION = 5
+_MENU_REBOOT = 6
+_MENU_BACKUP = 7
+_MENU_MARKERS = 8
+_MENU_LOG = 9
+_MENU_TICKS = 10
+_MENU_BOOT = 11
+_MENU_MEMORY = 12
+
+_STAT_NAMES = ('min', 'avg', 'high', 'max', 'median', 'p90')  # Indexed by menu tick
+_READOUT_SLOTS = 10  # Glyph cells per realtime readout, if the font is narrow enough to fit three of them
+_EXPORT_COLORS = (Neopixel.GREEN, Neopixel.LIME, Neopixel.YELLOW)
+_IMPORT_COLORS = (Neopixel.BLUE, Neopixel.PURPLE, Neopixel.RED)
 
 
 class Monitor(object):
@@ -31,62 +54,95 @@ class Monitor(object):
     def __init__(
         self,
         solar_topic, grid_topic, mqtt_broker, wifi_credentials,
-        graph_interval_s=60, update_interval_ms=1000
+        graph_interval_s=60, update_interval_ms=1000, feeds=None, backfill=None, http_port=None,
+        aggregator_topic=None, boot_ticks=None
     ):
-        self._solar_topic = solar_topic
-        self._grid_topic = grid_topic
+        # Boot timeline; (stage, start in µs since boot, duration in µs)
+        self._boot_ticks = time.ticks_us() if boot_ticks is None else boot_ticks
+        self._timeline = []
+        self._booting = True  # Stages are only added to the timeline during the first connect
+        stage_ticks = self._mark('import', self._boot_ticks)
+
+        # Feed registry; feeds are addressed by their integer id everywhere else
+        self._feed_ids, self._feed_names, feed_colors = build_registry(solar_topic, grid_topic, feeds)
+        self._feed_count = len(self._feed_names)
+        self._feed_labels = ['{0}{1}'.format(name[0].upper(), name[1:]) for name in self._feed_names]
+        self._feed_colors = None
+        self._feed_name_bytes = [name.encode() for name in self._feed_names]
         self._mqtt_broker = mqtt_broker
+        self._backfill_config = backfill
+        self._http_port = http_port
+        self._aggregator_topic = aggregator_topic
+        self._mqtt_topic = 'emon/#' if aggregator_topic is None else '{0}/#'.format(aggregator_topic)
         self._wifi_credentials = wifi_credentials
         self._graph_interval = graph_interval_s
         self._update_interval = update_interval_ms
         self._graph_window = Monitor._shorten(self._graph_interval * 320)
 
         self._tft = None
+        self._readouts = None
+        self._readout_height = 0
         self._wlan = None
         self._mqtt = None
         self._neopixel = None
+        self._server = None
+        self._connecting = False
+        self._running = False  # Set once the timer ticks
+        self._backfill_since = None  # Start of the first bucket to backfill, None for the complete graph
+        self._backfilled = None  # Rows fetched by the init thread, waiting to be appended by the tick
+        self._pending_logline = None  # Text for the realtime line, waiting to be drawn by the tick
 
         self._battery = IP5306(I2C(scl=Pin(22), sda=Pin(21)))
         self._timer = Timer(0)
+        self._http_timer = Timer(1)
         self._rtc = RTC()
         self._button_a = ButtonA(callback=self._button_a_pressed)
         self._button_b = ButtonB(callback=self._button_b_pressed)
         self._button_c = ButtonC(callback=self._button_c_pressed)
+        stage_ticks = self._mark('peripherals', stage_ticks)
 
         self._reboot = False
         self._backup = False
-        self._solar = None
-        self._usage = None
-        self._grid = None
         self._importing = None
         self._prev_importing = None
-        self._solar_avg_buffer = []
-        self._grid_avg_buffer = []
-        self._usage_buffer = []
-        self._usage_buffer_max = 0
-        self._usage_buffer_min = 0
-        self._usage_buffer_avg = 0
-        self._usage_buffer_stddev = 0
-        self._usage_max_coords = [0, 0]
-        self._calculate_buffer_stats('usage', 0)
-        self._solar_buffer = []
-        self._solar_buffer_max = 0
-        self._solar_buffer_min = 0
-        self._solar_buffer_avg = 0
-        self._solar_buffer_stddev = 0
+        self._store = FeedStore(self._feed_count)  # The store keeps 319 pixels, one is left for the moving avg
+        self._sampler = FeedSampler(self._store, self._graph_interval)
+        self._realtime = self._sampler.realtime  # In centiwatts
+        self._row = [0] * self._feed_count
+        self._averages = [0] * self._feed_count
+        self._buffer_max = [0] * self._feed_count
+        self._buffer_min = [0] * self._feed_count
+        self._buffer_avg = [0] * self._feed_count  # In centiwatts
+        self._buffer_stddev = [0] * self._feed_count  # In centiwatts
+        self._live_values = [0] * 8  # Values of a single feed, read from a LIVE frame
+        self._buffer_median = [0] * self._feed_count  # Only provided by the aggregator
+        self._buffer_p90 = [0] * self._feed_count  # Only provided by the aggregator
+        self._usage_high = 0  # Usage above avg + 2 * stddev is considered high, in centiwatts
+        self._usage_max_coords = [0, 0]  # Coordinate slots are updated in place
         self._solar_max_coords = [0, 0]
-        self._calculate_buffer_stats('solar', 0)
-        self._last_update = (0, 0, 0, 0, 0, 0)
-        self._data_received = [False, False]
+        self._graph_line_y = [0, 0]  # Usage & solar y of the last drawn graph line
+        self._last_update = 0
         self._buffer_updated = False
         self._realtime_updated = False
-        self._last_value_added = None
+        self._realtime_line_dirty = True  # Something else (e.g. a log line) was drawn on the realtime line
+        self._backup_last_value_added = None
         self._graph_max = 0
         self._solar_max = 0
         self._usage_max = 0
+        self._solar_marker = '0W'
+        self._usage_marker = '0W'
+        self._menu_pages = [(_MENU_UPDATED, None), (_MENU_BATTERY, None), (_MENU_GRAPH, None)]
+        for feed_id in range(self._feed_count):
+            if feed_id != GRID:
+                self._menu_pages.append((_MENU_STATS, feed_id))
+        for page in [_MENU_TIME, _MENU_EXCEPTION, _MENU_REBOOT, _MENU_BACKUP, _MENU_MARKERS, _MENU_LOG, _MENU_TICKS, _MENU_BOOT, _MENU_MEMORY]:
+            self._menu_pages.append((page, None))
         self._menu_horizontal_pointer = 0
         self._menu_tick = 0
         self._menu_tick_divider = 0
+        self._menu_timeline_pointer = 0
+        self._menu_ticks = 4 if aggregator_topic is None else 6
+        self._menu_key = [None] * 5  # Menu page and the values its line was composed from
         self._blank_menu = False
         self._save = False
         self._show_markers = True
@@ -101,6 +157,12 @@ class Monitor(object):
         self._last_exception = 'None'
         self._runtime_config_parameters = ['show_markers']
         self._last_logline = ''
+        self._gc_threshold = (gc.mem_free() + gc.mem_alloc()) // 4  # Collect once less than 25% of the heap is free
+        self._gc_count = 0
+        self._gc_last_pause = 0
+        self._gc_max_pause = 0
+        self._largest_block = 0  # Probed right after every explicit collection
+        self._largest_block_probe = 0  # Time the last probe took, not part of the pause
 
         self._log('Initializing TFT...')
         self._tft = display.TFT()
@@ -108,14 +170,60 @@ class Monitor(object):
         self._tft.tft_writecmd(0x21)  # Invert colors
         self._tft.clear()
         self._tft.font(self._tft.FONT_Default, transparent=False)
+        self._feed_colors = [getattr(self._tft, color) for color in feed_colors]
+        # Rendered in the (still empty) graph area
+        glyphs = GlyphCache(self._tft, [self._tft.YELLOW, self._tft.BLUE, self._tft.RED, self._tft.GREEN], 0, 40)
+        slots = min(_READOUT_SLOTS, 320 // (3 * glyphs.width))  # The readouts can't overlap
+        width = slots * glyphs.width
+        self._readout_height = glyphs.height
+        self._readouts = [Readout(glyphs, 320 - width, 14, slots, RIGHT),  # Solar
+                          Readout(glyphs, (320 - width) // 2, 14, slots, CENTER),  # Grid
+                          Readout(glyphs, 0, 14, slots, LEFT)]  # Usage
         self._tft.text(0, 0, 'USAGE', self._tft.DARKGREY)
         self._tft.text(self._tft.CENTER, 0, 'IMPORTING', self._tft.DARKGREY)
         self._tft.text(self._tft.RIGHT, 0, 'SOLAR', self._tft.DARKGREY)
         self._tft.text(0, 14, 'Loading...', self._tft.DARKGREY)
         self._log('Initializing TFT... Done')
+        self._mark('tft', stage_ticks)
 
-    def init(self):
+    def _mark(self, stage, stage_ticks):
+        """ Adds a stage, started at `stage_ticks`, to the boot timeline and returns the current ticks """
+        now = time.ticks_us()
+        duration = time.ticks_diff(now, stage_ticks)
+        if self._booting:
+            self._timeline.append((stage, time.ticks_diff(stage_ticks, self._boot_ticks), duration))
+            self._log('Boot stage {0}: {1}us'.format(stage, duration))
+        else:
+            self._log('Reconnect stage {0}: {1}us'.format(stage, duration))
+        return now
+
+    def init(self, background=False):
+        """ Connects in a background thread (so the display keeps running) or blocking """
+        self._connecting = True
+        # Taken before connecting, so live samples can't move it before the missed buckets are backfilled
+        last_value_added = self._sampler.last_value_added
+        self._backfill_since = self._backup_last_value_added if last_value_added is None else last_value_added
+        if background:
+            import _thread
+            _thread.start_new_thread('init', self._init, ())
+        else:
+            self._init()
+
+    def _init(self):
         """ Init logic; connect to wifi, connect to MQTT and setup RTC/NTP """
+        try:
+            self._connect()
+        except Exception as ex:
+            self._last_exception = str(ex)
+            self._ticks['E'] += 1
+            self._log('Exception in init: {0}'.format(ex))
+        self._booting = False  # Reconnects don't add to the boot timeline
+        self._connecting = False
+
+    def _connect(self):
+        import network
+        import ubinascii
+        stage_ticks = time.ticks_us()
         self._log('Connecting to wifi ({0})... '.format(self._wifi_credentials[0]), tft=True)
         self._wlan = network.WLAN(network.STA_IF)
         self._wlan.active(True)
@@ -126,19 +234,23 @@ class Monitor(object):
             time.sleep(1)
             safety -= 1
         self._log('Connecting to wifi ({0})... {1}'.format(self._wifi_credentials[0], 'Done' if safety else 'Fail'))
+        stage_ticks = self._mark('wifi', stage_ticks)
         mac_address = ubinascii.hexlify(self._wlan.config('mac'), ':').decode()
-        self._log('Connecting to MQTT...', tft=True)
+        if self._http_port is not None and self._server is None:
+            from httpserver import HttpServer
+            self._log('Starting HTTP server...', tft=True)
+            self._server = HttpServer(port=self._http_port)
+            self._server.route('/values.csv', 'text/csv', self._http_values)
+            self._server.route('/graph.csv', 'text/csv', self._http_graph_csv)
+            self._server.route('/graph.bin', 'application/octet-stream', self._http_graph_binary)
+            self._server.route('/diagnostics.csv', 'text/csv', self._http_diagnostics)
+            self._server.route('/screenshot.bmp', 'image/bmp', self._http_screenshot)
+            self._server.start()
+            self._http_timer.init(period=50, mode=Timer.PERIODIC, callback=self._poll_http)
+            self._log('Starting HTTP server... Done')
+            stage_ticks = self._mark('http', stage_ticks)
         if self._mqtt is not None:
-            self._mqtt.unsubscribe('emon/#')
-        self._mqtt = network.mqtt('emon', self._mqtt_broker, user='emonpi', password='emonpimqtt2016', clientid=mac_address, data_cb=self._process_data)
-        self._mqtt.start()
-        safety = 5
-        while self._mqtt.status()[0] != 2 and safety > 0:
-            # Wait for MQTT connection, max 5s
-            time.sleep(1)
-            safety -= 1
-        self._mqtt.subscribe('emon/#')
-        self._log('Connecting to MQTT... {0}'.format('Done' if safety else 'Fail'))
+            self._mqtt.unsubscribe(self._mqtt_topic)  # No live samples until the backfill is done
         self._log('Sync NTP...', tft=True)
         self._rtc.ntp_sync(server='be.pool.ntp.org', tz='CET-1CEST-2')
         safety = 5
@@ -146,8 +258,28 @@ class Monitor(object):
             # Wait for NTP time sync, max 5s
             time.sleep(1)
             safety -= 1
-        self._last_update = self._rtc.now()
+        self._last_update = time.time()
         self._log('Sync NTP... {0}'.format('Done' if safety else 'Fail'))
+        stage_ticks = self._mark('ntp', stage_ticks)
+        if self._backfill_config is not None and self._aggregator_topic is None and safety:
+            self._backfill()
+            stage_ticks = self._mark('backfill', stage_ticks)
+        # Only subscribe once the backfilled rows are in the store, so they're not mixed with live buckets
+        self._log('Connecting to MQTT...', tft=True)
+        if self._aggregator_topic is not None:
+            global frames
+            import frames
+        data_cb = self._process_data if self._aggregator_topic is None else self._process_frame
+        self._mqtt = network.mqtt('emon', self._mqtt_broker, user='emonpi', password='emonpimqtt2016', clientid=mac_address, data_cb=data_cb)
+        self._mqtt.start()
+        safety = 5
+        while self._mqtt.status()[0] != 2 and safety > 0:
+            # Wait for MQTT connection, max 5s
+            time.sleep(1)
+            safety -= 1
+        self._mqtt.subscribe(self._mqtt_topic)
+        self._log('Connecting to MQTT... {0}'.format('Done' if safety else 'Fail'))
+        stage_ticks = self._mark('mqtt', stage_ticks)
         self._log('Initializing Neopixels...', tft=True)
         try:
             self._neopixel = Neopixel(Pin(15), 10, Neopixel.TYPE_RGB)
@@ -155,80 +287,143 @@ class Monitor(object):
         except Exception:
             self._neopixel = None
         self._log('Initializing Neopixels... {0}'.format('Available' if self._neopixel is not None else 'Unavailable'))
-        self._tft.text(0, 14, ' ' * 50, self._tft.DARKGREY)  # Clear the line
+        self._mark('neopixel', stage_ticks)
+        self._show_logline('')  # Clear the line
 
     def _process_data(self, message):
         """ Process MQTT message """
         try:
-            topic = message[1]
-            data = float(message[2])
             self._ticks['M'] += 1
-
-            # Collect data samples from solar & grid
-            if topic == self._solar_topic:
-                self._solar = max(0.0, data)
-                self._data_received[0] = True
-            elif topic == self._grid_topic:
-                self._grid = data
-                self._data_received[1] = True
-
-            if self._data_received[0] and self._data_received[1]:
+            feed_id = self._feed_ids.get(message[1])
+            if feed_id is None:
+                return
+            now = time.time()
+            result = self._sampler.process(feed_id, parse_centi(message[2]), now)
+            if result & SAMPLE:
                 self._ticks['D'] += 1
-                # Once the data has been received, calculate realtime usage
-                self._usage = self._solar + self._grid
-
-                self._last_update = self._rtc.now()
+                self._ticks['R'] = self._sampler.remaining
+                self._last_update = now
                 self._realtime_updated = True  # Redraw realtime values
-                self._data_received = [False, False]
+            if result & BUCKET:
+                self._ticks['G'] += 1
+                self._calculate_buffer_stats()
+                self._buffer_updated = True  # Redraw the complete graph
+        except Exception as ex:
+            self._last_exception = str(ex)
+            self._ticks['E'] += 1
+            self._log('Exception in process data: {0}'.format(ex))
 
-                # Process data for the graph; collect solar & grids, and every x-pixel
-                # average the data out and draw them on that pixel.
+    def _process_frame(self, message):
+        """ Process a pre-aggregated frame, published by the aggregator """
+        try:
+            self._ticks['M'] += 1
+            frame = message[2]
+            if not isinstance(frame, bytes):
+                frame = frame.encode()
+            frame_type, feed_count, timestamp, interval = frames.read_header(frame)
+            if feed_count != self._feed_count:
+                raise ValueError('Frame has {0} feeds, expected {1}'.format(feed_count, self._feed_count))
+            if interval != self._graph_interval:
+                self._graph_interval = interval
+                self._sampler.graph_interval = interval
+                self._graph_window = Monitor._shorten(interval * 320)
+            if frame_type == frames.HISTORY:
+                frames.read_history(frame, self._store)
+                self._sampler.last_value_added = timestamp
+                self._ticks['G'] += 1
+                self._buffer_updated = True  # Redraw the complete graph
+            elif frame_type == frames.LIVE:
+                # The bucket averages are loaded into the store, so the moving avg is drawn as usual
+                self._store.clear_bucket()
+                values = self._live_values
+                for feed_id in range(self._feed_count):
+                    frames.read_live_into(frame, feed_id, values)
+                    self._realtime[feed_id] = values[0]
+                    self._buffer_min[feed_id] = values[2]
+                    self._buffer_max[feed_id] = values[3]
+                    self._buffer_avg[feed_id] = values[4]
+                    self._buffer_stddev[feed_id] = values[5]
+                    self._buffer_median[feed_id] = values[6]
+                    self._buffer_p90[feed_id] = values[7]
+                    if feed_id != USAGE:
+                        self._store.accumulate(feed_id, values[1])
+                self._usage_high = self._buffer_avg[USAGE] + self._buffer_stddev[USAGE] * 2
                 now = time.time()
-                rounded_now = int(now - now % self._graph_interval)
-                if self._last_value_added is None:
-                    self._last_value_added = rounded_now
-                self._ticks['R'] = int(rounded_now + self._graph_interval - now)
-                self._solar_avg_buffer.append(int(self._solar))
-                self._grid_avg_buffer.append(int(self._grid))
-                if self._last_value_added != rounded_now:
-                    self._ticks['G'] += 1
-                    solar, usage = self._read_avg_buffer(reset=True)
-                    self._solar_buffer.append(solar)
-                    self._solar_buffer = self._solar_buffer[-319:]  # Keep one pixel for moving avg
-                    self._calculate_buffer_stats('solar', solar)
-                    self._usage_buffer.append(usage)
-                    self._usage_buffer = self._usage_buffer[-319:]  # Keep one pixel for moving avg
-                    self._calculate_buffer_stats('usage', usage)
-                    self._last_value_added = rounded_now
-                    self._buffer_updated = True  # Redraw the complete graph
+                self._ticks['D'] += 1
+                self._ticks['R'] = int(timestamp + interval - now)
+                self._last_update = now
+                self._realtime_updated = True  # Redraw realtime values
         except Exception as ex:
             self._last_exception = str(ex)
             self._ticks['E'] += 1
-            self._log('Exception in process data: {0}'.format(ex))
+            self._log('Exception in process frame: {0}'.format(ex))
 
-    def _calculate_buffer_stats(self, buffer_type, single_value):
-        buffer = getattr(self, '_{0}_buffer'.format(buffer_type))
-        if len(buffer) == 0:
+    def _calculate_buffer_stats(self):
+        if self._store.length == 0:
             return
-        setattr(self, '_{0}_buffer_max'.format(buffer_type), single_value if len(buffer) == 1 else max(*buffer))
-        setattr(self, '_{0}_buffer_min'.format(buffer_type), single_value if len(buffer) == 1 else min(*buffer))
-        setattr(self, '_{0}_buffer_avg'.format(buffer_type), sum(buffer) / len(buffer))
-        setattr(self, '_{0}_buffer_stddev'.format(buffer_type), Monitor._stddev(buffer))
-
-    def _read_avg_buffer(self, reset):
-        solar_avg_buffer_length = len(self._solar_avg_buffer)
-        grid_avg_buffer_length = len(self._grid_avg_buffer)
-        if solar_avg_buffer_length == 0 or grid_avg_buffer_length == 0:
-            return 0, 0
-        solar = int(sum(self._solar_avg_buffer) / solar_avg_buffer_length)
-        grid = int(sum(self._grid_avg_buffer) / grid_avg_buffer_length)
-        usage = solar + grid
-        if reset:
-            self._solar_avg_buffer = []
-            self._grid_avg_buffer = []
-        return solar, usage
+        for feed_id in range(self._feed_count):
+            minimum, maximum, avg, stddev = self._store.stats(feed_id)
+            self._buffer_min[feed_id] = minimum
+            self._buffer_max[feed_id] = maximum
+            self._buffer_avg[feed_id] = int(avg * 100)
+            self._buffer_stddev[feed_id] = int(stddev * 100)
+        self._usage_high = self._buffer_avg[USAGE] + self._buffer_stddev[USAGE] * 2
+
+    def _backfill(self):
+        """
+        Fetches the graph buckets that were missed (e.g. during a reboot) from emoncms into a separate
+        store. The live store is only changed by the tick (see `_apply_backfill`).
+        """
+        from backfill import fill as backfill_feed
+        now = time.time()
+        rounded_now = int(now - now % self._graph_interval)
+        if self._backfill_since is None:
+            missing = self._store.size
+        else:
+            missing = min(self._store.size, int((rounded_now - self._backfill_since) / self._graph_interval))
+        if missing <= 0:
+            return
+        self._log('Backfilling {0} datapoints...'.format(missing), tft=True)
+        start = rounded_now - missing * self._graph_interval
+        rows = FeedStore(self._feed_count, size=missing)
+        rows.extend(missing)
+        feed_ids = self._backfill_config['feed_ids']
+        for feed_id, name in enumerate(self._feed_names):
+            if feed_id == USAGE or name not in feed_ids:
+                continue
+            try:
+                backfill_feed(rows, feed_id, self._backfill_config['url'], self._backfill_config.get('apikey', ''),
+                              feed_ids[name], start, missing, self._graph_interval)
+            except Exception as ex:
+                self._last_exception = str(ex)
+                self._ticks['E'] += 1
+                self._log('Exception in backfill ({0}): {1}'.format(name, ex))
+        rows.recalculate_usage(0)
+        self._backfilled = (rows, rounded_now)
+        if not self._running:
+            self._apply_backfill()
+        while self._backfilled is not None:
+            # Wait for the tick to append the rows
+            time.sleep_ms(50)
+        self._log('Backfilling {0} datapoints... Done'.format(missing))
+
+    def _apply_backfill(self):
+        """ Appends the rows fetched by `_backfill`; runs from the tick, like every other change to the store """
+        if self._backfilled is None:
+            return
+        rows, rounded_now = self._backfilled
+        self._store.clear_bucket()  # A partially collected bucket is covered by the backfill
+        row = self._row
+        for index in range(rows.length):
+            rows.read_row(index, row)
+            self._store.append(row)
+        self._calculate_buffer_stats()
+        self._sampler.last_value_added = rounded_now
+        self._buffer_updated = True
+        self._backfilled = None
 
     def load(self):
+        stage_ticks = time.ticks_us()
         self._log('Loading runtime configuration...', tft=True)
         if 'runtime_config.json' in os.listdir('/flash'):
             with open('/flash/runtime_config.json', 'r') as f:
@@ -241,25 +436,44 @@ class Monitor(object):
         if 'backup.json' in os.listdir('/flash'):
             with open('/flash/backup.json', 'r') as f:
                 backup = ujson.load(f)
-            self._usage_buffer = backup.get('usage_buffer', [])
-            self._calculate_buffer_stats('usage', 0)
-            self._solar_buffer = backup.get('solar_buffer', [])
-            self._calculate_buffer_stats('solar', 0)
+            buffers = [backup.get('{0}_buffer'.format(name)) for name in self._feed_names]
+            if buffers[GRID] is None and buffers[SOLAR] and buffers[USAGE]:
+                # Older backups only hold solar & usage
+                buffers[GRID] = [usage - solar for solar, usage in zip(buffers[SOLAR], buffers[USAGE])]
+            self._store.restore(buffers)
+            self._calculate_buffer_stats()
+            self._backup_last_value_added = backup.get('last_value_added')
+            self._buffer_updated = True
             os.remove('/flash/backup.json')
+            backup = None  # The parsed backup is garbage now, it's collected before the timers start
+            buffers = None
         self._log('Restoring backup... Done', tft=True)
+        self._mark('load', stage_ticks)
 
     def run(self):
-        """ Set timer """
+        """ Draw what is already known (e.g. a restored graph) and set timer """
+        stage_ticks = time.ticks_us()
+        self._draw()
+        self._mark('first draw', stage_ticks)
+        self._collect_garbage(force=True)
+        self._running = True
         self._timer.init(period=self._update_interval, mode=Timer.PERIODIC, callback=self._tick)
 
     def _tick(self, timer):
         """ Do stuff at a regular interval """
         _ = timer
+        try:
+            self._apply_backfill()
+        except Exception as ex:
+            self._last_exception = str(ex)
+            self._ticks['E'] += 1
+            self._log('Exception in apply backfill: {0}'.format(ex))
+            self._backfilled = None
         self._draw()
         try:
             # At every tick, make sure wifi is still connected
-            if not self._wlan.isconnected():
-                self.init()
+            if self._wlan is not None and not self._connecting and not self._wlan.isconnected():
+                self.init(background=True)
         except Exception as ex:
             self._last_exception = str(ex)
             self._ticks['E'] += 1
@@ -275,6 +489,156 @@ class Monitor(object):
         if self._save:
             self._save_runtime_config()
             self._save = False
+        self._collect_garbage()
+
+    def _collect_garbage(self, force=False):
+        """
+        Collects garbage at a fixed point in the tick (after drawing), before the heap runs out at a random point.
+        The largest free block is probed right after; that's timed on its own, so the pause only covers the collection.
+        """
+        if not force and gc.mem_free() > self._gc_threshold:
+            return
+        start = time.ticks_us()
+        gc.collect()
+        pause = time.ticks_diff(time.ticks_us(), start)
+        self._gc_count += 1
+        self._gc_last_pause = pause
+        if pause > self._gc_max_pause:
+            self._gc_max_pause = pause
+        start = time.ticks_us()
+        self._largest_block = self._largest_free_block()
+        self._largest_block_probe = time.ticks_diff(time.ticks_us(), start)
+
+    @staticmethod
+    def _largest_free_block():
+        """ Probes the largest block that can still be allocated (binary search), which shows heap fragmentation """
+        low = 0
+        high = gc.mem_free()
+        while high - low > 256:
+            size = (low + high) // 2
+            try:
+                block = bytearray(size)
+                block = None  # A failing allocation collects, so earlier probes don't get in the way
+                low = size
+            except MemoryError:
+                high = size
+        return low
+
+    def _poll_http(self, timer):
+        """ Serves HTTP clients, a little bit at a time """
+        _ = timer
+        try:
+            self._server.poll()
+        except Exception as ex:
+            self._last_exception = str(ex)
+            self._ticks['E'] += 1
+            self._log('Exception in HTTP server: {0}'.format(ex))
+
+    def _http_values(self):
+        """ Realtime value and graph stats per feed, as CSV """
+        from httpserver import write_csv_row
+        yield b'feed,realtime,min,max,avg,stddev\n'
+        line = bytearray(96)
+        values = [0] * 5
+        for feed_id in range(self._feed_count):
+            values[0] = truncate_centi(self._realtime[feed_id])
+            values[1] = self._buffer_min[feed_id]
+            values[2] = self._buffer_max[feed_id]
+            values[3] = truncate_centi(self._buffer_avg[feed_id])
+            values[4] = truncate_centi(self._buffer_stddev[feed_id])
+            length = write_csv_row(line, values, 5, label=self._feed_name_bytes[feed_id])
+            yield memoryview(line)[:length]
+
+    def _http_graph_csv(self):
+        """ Graph history as CSV, oldest first, streamed row by row from the feed store """
+        from httpserver import write_bytes, write_csv_row
+        line = bytearray(16 * (self._feed_count + 1))
+        length = write_bytes(line, 0, b'time')
+        for name in self._feed_name_bytes:
+            line[length] = 44  # ,
+            length = write_bytes(line, length + 1, name)
+        line[length] = 10  # \n
+        yield memoryview(line)[:length + 1]
+        # The store keeps changing in between polls; rows are read from this snapshot and the
+        # response stops (short) once the store changed, rather than mixing old and new rows
+        store = self._store
+        changes = store.changes
+        length = store.length
+        first = store.position(0)
+        last_value_added = self._sampler.last_value_added or 0
+        row = [0] * (self._feed_count + 1)
+        for index in range(length):
+            row[0] = last_value_added - (length - index) * self._graph_interval
+            position = (first + index) % store.size
+            for feed_id in range(self._feed_count):
+                row[feed_id + 1] = store.columns[feed_id][position]
+            if store.changes != changes:
+                self._log('Graph changed while sending graph.csv, stopped at row {0}'.format(index))
+                return
+            yield memoryview(line)[:write_csv_row(line, row, self._feed_count + 1)]
+
+    def _http_graph_binary(self):
+        """
+        Graph history as little-endian binary: a header (uint16 feed count, uint16 length,
+        int32 graph interval, int32 timestamp of the bucket after the last one), followed by
+        one int32 column per feed, oldest first. The columns are copied into a reused chunk,
+        since the server sends bytes and an array's memoryview can't be cast everywhere.
+        The columns are read from a snapshot of the store; if it changes while sending, the
+        response stops short of the length in the header.
+        """
+        store = self._store
+        changes = store.changes
+        length = store.length
+        first = store.position(0)
+        yield ustruct.pack('<HHii', self._feed_count, length, self._graph_interval, self._sampler.last_value_added or 0)
+        chunk = bytearray(256)
+        for column in store.columns:
+            offset = 0
+            for index in range(length):
+                ustruct.pack_into('<i', chunk, offset, column[(first + index) % store.size])
+                offset += 4
+                if offset == len(chunk) or index == length - 1:
+                    if store.changes != changes:
+                        self._log('Graph changed while sending graph.bin')
+                        return
+                    yield chunk if offset == len(chunk) else memoryview(chunk)[:offset]
+                    offset = 0
+
+    def _http_diagnostics(self):
+        """ Tick counters, boot timeline (µs per stage) and the last exception, as CSV """
+        from httpserver import write_csv_row
+        line = bytearray(48)
+        values = [0]
+        for key in self._tick_keys:
+            values[0] = self._ticks[key]
+            yield memoryview(line)[:write_csv_row(line, values, 1, label=key.encode())]
+        for stage, _, duration in self._timeline:
+            values[0] = duration
+            yield memoryview(line)[:write_csv_row(line, values, 1, label='boot {0}'.format(stage).encode())]
+        for label, value in ((b'mem_free', gc.mem_free()), (b'largest_block', self._largest_block),
+                             (b'largest_block_probe_us', self._largest_block_probe),
+                             (b'gc_count', self._gc_count), (b'gc_last_us', self._gc_last_pause),
+                             (b'gc_max_us', self._gc_max_pause)):
+            values[0] = value
+            yield memoryview(line)[:write_csv_row(line, values, 1, label=label)]
+        yield b'exception,'
+        yield self._last_exception.encode()
+        yield b'\nlog,'
+        yield self._last_logline.encode()
+        yield b'\n'
+
+    def _http_screenshot(self):
+        """ Streams the display contents as a 24-bit BMP, one line at a time """
+        width, height = self._tft.screensize()
+        size = width * height * 3
+        yield ustruct.pack('<BBIHHIIiiHHIIiiII', 66, 77, 54 + size, 0, 0, 54,
+                           40, width, height, 1, 24, 0, size, 2835, 2835, 0, 0)
+        line = bytearray(width * 3)
+        for y in range(height - 1, -1, -1):  # BMP lines are stored bottom-up
+            self._tft.readScreen(0, y, width, 1, line)
+            for offset in range(0, width * 3, 3):  # RGB to BGR
+                line[offset], line[offset + 2] = line[offset + 2], line[offset]
+            yield line
 
     def _save_runtime_config(self):
         data = {}
@@ -284,12 +648,23 @@ class Monitor(object):
             runtime_config_file.write(ujson.dumps(data))
 
     def _take_backup(self):
+        data = {'last_value_added': self._sampler.last_value_added}
+        for feed_id, name in enumerate(self._feed_names):
+            data['{0}_buffer'.format(name)] = self._store.values(feed_id)
         with open('/flash/backup.json', 'w') as backup_file:
-            backup_file.write(ujson.dumps({'usage_buffer': self._usage_buffer,
-                                           'solar_buffer': self._solar_buffer}))
+            backup_file.write(ujson.dumps(data))
 
     def _draw(self):
         """ Update display """
+        try:
+            logline = self._pending_logline
+            if logline is not None:
+                self._pending_logline = None
+                self._draw_logline(logline)
+        except Exception as ex:
+            self._last_exception = str(ex)
+            self._ticks['E'] += 1
+            self._log('Exception in draw log: {0}'.format(ex))
         try:
             self._draw_realtime()
         except Exception as ex:
@@ -319,100 +694,125 @@ class Monitor(object):
         """ Uses the neopixel leds (if available) to indicate how "good" our power consumption is. """
         if self._neopixel is None:
             return
-        if len(self._solar_buffer) == 0 or self._usage is None:
+        if self._store.length == 0 or self._ticks['D'] == 0:
             self._neopixel.clear()
             return
 
-        high_usage = self._usage > self._usage_buffer_avg + (self._usage_buffer_stddev * 2)
-        if self._grid < 0:
+        grid = self._realtime[GRID]  # All realtime values and thresholds are in centiwatts
+        high_usage = self._realtime[USAGE] > self._usage_high
+        if grid < 0:
             # Feeding back to the grid
             score = 0
-            if self._grid < -500:
+            if grid < -50000:
                 score += 1
-            if self._grid < -1000:
+            if grid < -100000:
                 score += 1
             if high_usage:
                 score -= 1
-            colors = [Neopixel.GREEN, Neopixel.LIME, Neopixel.YELLOW]
-            color = colors[max(0, score)]
+            color = _EXPORT_COLORS[max(0, score)]
         else:
             score = 0
             if high_usage:
                 score += 1
-            if self._solar == 0:
+            if self._realtime[SOLAR] == 0:
                 score += 1
-            colors = [Neopixel.BLUE, Neopixel.PURPLE, Neopixel.RED]
-            color = colors[max(0, score)]
+            color = _IMPORT_COLORS[max(0, score)]
         if self._color != color:
             self._neopixel.set(0, color, num=10)
             self._color = color
 
     def _draw_realtime(self):
-        """ Realtime part; current usage, importing/exporting and solar """
+        """ Realtime part; current usage, importing/exporting and solar. Only the changed glyphs are redrawn """
         if not self._realtime_updated:
             return
 
-        self._tft.text(self._tft.RIGHT, 14, '          {0:.2f}W'.format(self._solar), self._tft.YELLOW)
-        self._tft.text(0, 14, '{0:.2f}W          '.format(self._usage), self._tft.BLUE)
-        self._importing = self._grid > 0
+        if self._realtime_line_dirty:
+            self._tft.rect(0, 14, 320, self._readout_height, self._tft.BLACK, self._tft.BLACK)
+            self._realtime_line_dirty = False
+        realtime = self._realtime
+        self._readouts[SOLAR].draw(realtime[SOLAR], self._tft.YELLOW)
+        self._readouts[USAGE].draw(realtime[USAGE], self._tft.BLUE)
+        grid = realtime[GRID]
+        self._importing = grid > 0
         if self._prev_importing != self._importing:
             if self._importing:
                 self._tft.text(self._tft.CENTER, 0, '  IMPORTING  ', self._tft.DARKGREY)
             else:
                 self._tft.text(self._tft.CENTER, 0, '  EXPORTING  ', self._tft.DARKGREY)
-        if self._importing:
-            self._tft.text(self._tft.CENTER, 14, '  {0:.2f}W  '.format(abs(self._grid)), self._tft.RED)
-        else:
-            self._tft.text(self._tft.CENTER, 14, '  {0:.2f}W  '.format(abs(self._grid)), self._tft.GREEN)
+        self._readouts[GRID].draw(-grid if grid < 0 else grid, self._tft.RED if self._importing else self._tft.GREEN)
         self._prev_importing = self._importing
         self._realtime_updated = False
 
+    def _invalidate_realtime(self):
+        """ Makes sure all realtime readouts are redrawn, e.g. after a log line overwrote them """
+        for readout in self._readouts:
+            readout.invalidate()
+        self._realtime_line_dirty = True
+        if self._ticks['D'] > 0:  # Only once there's something to draw
+            self._realtime_updated = True
+
     def _draw_graph(self):
         """ Draw the graph part """
-        solar_moving_avg, usage_moving_avg = self._read_avg_buffer(reset=False)
-        solar_max = max(self._solar_buffer_max, solar_moving_avg)
-        usage_max = max(self._usage_buffer_max, usage_moving_avg)
-        max_value = float(max(solar_max, usage_max))
+        store = self._store
+        averages = self._averages
+        store.read_averages(averages)
+        solar_moving_avg = averages[SOLAR]
+        usage_moving_avg = averages[USAGE]
+        solar_max = max(self._buffer_max[SOLAR], solar_moving_avg)
+        usage_max = max(self._buffer_max[USAGE], usage_moving_avg)
+        max_value = max(solar_max, usage_max)
         if max_value != self._graph_max:
             self._graph_max = max_value
             self._buffer_updated = True
         if solar_max != self._solar_max:
             self._solar_max = solar_max
+            self._solar_marker = '{0}W'.format(solar_max)
             self._buffer_updated = True
         if usage_max != self._usage_max:
             self._usage_max = usage_max
+            self._usage_marker = '{0}W'.format(usage_max)
             self._buffer_updated = True
-        ratio = 1 if max_value == 0 else (180.0 / max_value)
         show_markers = self._show_markers and max_value > 0
-        buffer_size = len(self._usage_buffer)
+        buffer_size = store.length
 
         avg_marker = False
+        line_y = self._graph_line_y
         usage_max_coords = self._usage_max_coords
         solar_max_coords = self._solar_max_coords
+        usage_max_x, usage_max_y = usage_max_coords
+        solar_max_x, solar_max_y = solar_max_coords
         if self._buffer_updated:
-            for index, usage in enumerate(self._usage_buffer):
-                solar = self._solar_buffer[index]
-                usage_y, solar_y = self._draw_graph_line(index, solar, usage, ratio)
-                if usage == usage_max:
-                    usage_max_coords = [index, usage_y]
-                if solar == solar_max:
-                    solar_max_coords = [index, solar_y]
-        usage_y, solar_y = self._draw_graph_line(buffer_size, solar_moving_avg, usage_moving_avg, ratio)
+            row = self._row
+            for index in range(buffer_size):
+                store.read_row(index, row)
+                self._draw_graph_line(index, row, max_value)
+                if row[USAGE] == usage_max:
+                    usage_max_x = index
+                    usage_max_y = line_y[0]
+                if row[SOLAR] == solar_max:
+                    solar_max_x = index
+                    solar_max_y = line_y[1]
+        self._draw_graph_line(buffer_size, averages, max_value)
         if usage_moving_avg == usage_max:
             avg_marker = True
-            usage_max_coords = [buffer_size, usage_y]
+            usage_max_x = buffer_size
+            usage_max_y = line_y[0]
         if solar_moving_avg == solar_max:
             avg_marker = True
-            solar_max_coords = [buffer_size, solar_y]
+            solar_max_x = buffer_size
+            solar_max_y = line_y[1]
 
-        max_coords_changed = self._usage_max_coords != usage_max_coords or self._solar_max_coords != solar_max_coords
+        max_coords_changed = (usage_max_coords[0] != usage_max_x or usage_max_coords[1] != usage_max_y or
+                              solar_max_coords[0] != solar_max_x or solar_max_coords[1] != solar_max_y)
+        usage_max_coords[0] = usage_max_x
+        usage_max_coords[1] = usage_max_y
+        solar_max_coords[0] = solar_max_x
+        solar_max_coords[1] = solar_max_y
         if self._buffer_updated and max_coords_changed:
             self._tft.rect(buffer_size + 1, 40, 320, 220, self._tft.BLACK, self._tft.BLACK)
         if show_markers:
-            self._draw_marker('{0:.0f}W'.format(solar_max), solar_max_coords, not avg_marker)
-            self._draw_marker('{0:.0f}W'.format(usage_max), usage_max_coords, not avg_marker)
-        self._usage_max_coords = usage_max_coords
-        self._solar_max_coords = solar_max_coords
+            self._draw_marker(self._solar_marker, solar_max_coords, not avg_marker)
+            self._draw_marker(self._usage_marker, usage_max_coords, not avg_marker)
         self._buffer_updated = False
 
     def _draw_marker(self, text, coords, transparent):
@@ -434,104 +834,173 @@ class Monitor(object):
         self._tft.line(line_start_x, y, line_end_x, text_y + 6, self._tft.DARKGREY)
         self._tft.font(self._tft.FONT_Default, transparent=False)
 
-    def _draw_graph_line(self, index, solar, usage, ratio):
-        usage_height = int(usage * ratio)
-        solar_height = int(solar * ratio)
+    def _draw_graph_line(self, index, row, max_value):
+        """
+        Draws a single graph column from a row of feed values, indexed by feed id. Heights are scaled
+        with integer math; the resulting usage & solar y are written into `_graph_line_y`.
+        """
+        usage_height = 0 if max_value <= 0 else max(0, row[USAGE] * 180 // max_value)
+        solar_height = 0 if max_value <= 0 else max(0, row[SOLAR] * 180 // max_value)
         usage_y = 220 - usage_height
         solar_y = 220 - solar_height
         max_height = max(usage_height, solar_height)
         self._tft.line(index, 40, index, 220 - max_height, self._tft.BLACK)
+        # Extra feeds are stacked from the bottom up, inside the usage area
+        stack_y = 220
+        for feed_id in range(FIRST_EXTRA, self._feed_count):
+            top_y = max(usage_y, stack_y - (0 if max_value <= 0 else max(0, row[feed_id]) * 180 // max_value))
+            if top_y < stack_y:
+                self._tft.line(index, top_y, index, stack_y, self._feed_colors[feed_id])
+                stack_y = top_y
         if usage_height > solar_height:
-            self._tft.line(index, usage_y, index, solar_y, self._tft.BLUE)
+            self._draw_graph_segment(index, usage_y, solar_y, stack_y, self._tft.BLUE)
             if solar_height > 0:
-                self._tft.line(index, solar_y, index, 220, self._tft.DARKCYAN)
+                self._draw_graph_segment(index, solar_y, 220, stack_y, self._tft.DARKCYAN)
         else:
-            self._tft.line(index, solar_y, index, usage_y, self._tft.YELLOW)
+            self._draw_graph_segment(index, solar_y, usage_y, stack_y, self._tft.YELLOW)
             if usage_height > 0:
-                self._tft.line(index, usage_y, index, 220, self._tft.DARKCYAN)
-        return usage_y, solar_y
+                self._draw_graph_segment(index, usage_y, 220, stack_y, self._tft.DARKCYAN)
+        self._graph_line_y[0] = usage_y
+        self._graph_line_y[1] = solar_y
+
+    def _draw_graph_segment(self, index, top_y, bottom_y, stack_y, color):
+        """ Draws a vertical segment, without overwriting the stacked feeds below `stack_y` """
+        if bottom_y > stack_y:
+            bottom_y = stack_y
+            if top_y >= bottom_y:
+                return
+        self._tft.line(index, top_y, index, bottom_y, color)
 
     def _draw_menu(self):
+        """ Draws the menu line; it's only composed again when the page or the values it shows changed """
         if self._blank_menu:
             self._tft.rect(0, 221, 320, 240, self._tft.BLACK, self._tft.BLACK)
             self._blank_menu = False
-        if self._menu_horizontal_pointer == 0:
-            data = 'Updated:  {0:04d}/{1:02d}/{2:02d} {3:02d}:{4:02d}:{5:02d}'.format(*self._last_update[:6])
-        elif self._menu_horizontal_pointer == 1:
-            data = 'Battery: {0}%'.format(self._battery.level)
-        elif self._menu_horizontal_pointer == 2:
-            data = 'Graph: {0} {1}, max {2:.2f}W'.format(len(self._usage_buffer), self._graph_window, self._graph_max)
-        elif self._menu_horizontal_pointer in [3, 4]:
-            data_type = 'solar' if self._menu_horizontal_pointer == 3 else 'usage'
-            solar, usage = self._read_avg_buffer(reset=False)
-            if self._menu_tick == 0:
-                value = min(
-                    getattr(self, '_{0}_buffer_min'.format(data_type)),
-                    solar if data_type == 'solar' else usage,
-                    self._solar if data_type == 'solar' else self._usage
-                )
-                info = 'min'
-            elif self._menu_tick == 1:
-                value = getattr(self, '_{0}_buffer_avg'.format(data_type))
-                info = 'avg'
-            elif self._menu_tick == 2:
-                value = getattr(self, '_{0}_buffer_avg'.format(data_type)) + (getattr(self, '_{0}_buffer_stddev'.format(data_type)) * 2)
-                info = 'high'
+            self._menu_key[0] = None
+        page, feed_id = self._menu_pages[self._menu_horizontal_pointer]
+        # Collect the values shown on the page; these are ints or existing objects, so nothing is allocated
+        first = second = third = fourth = None
+        if page == _MENU_UPDATED:
+            first = self._last_update
+        elif page == _MENU_BATTERY:
+            first = self._battery.level
+        elif page == _MENU_GRAPH:
+            first = self._store.length
+            second = self._graph_window
+            third = self._graph_max
+        elif page == _MENU_STATS:
+            first = self._menu_tick
+            second = self._stat(feed_id, self._menu_tick)
+        elif page == _MENU_TIME:
+            first = time.time()
+        elif page == _MENU_EXCEPTION:
+            first = self._last_exception
+        elif page == _MENU_MARKERS:
+            first = self._show_markers
+        elif page == _MENU_LOG:
+            first = self._last_logline
+        elif page == _MENU_TICKS:
+            ticks = self._ticks
+            first = ticks['M'] + ticks['D'] + ticks['G'] + ticks['B'] + ticks['E']  # These only increase
+            second = ticks['R']
+        elif page == _MENU_BOOT:
+            first = self._menu_timeline_pointer % len(self._timeline)
+        elif page == _MENU_MEMORY:
+            first = self._menu_tick % 2
+            if first == 0:
+                second = gc.mem_free() // 1024
+                third = self._largest_block // 1024
             else:
-                value = max(
-                    getattr(self, '_{0}_buffer_max'.format(data_type)),
-                    solar if data_type == 'solar' else usage,
-                    self._solar if data_type == 'solar' else self._usage
-                )
-                info = 'max'
-            data = '{0}{1} stats: {2:.2f}W {3}'.format(data_type[0].upper(), data_type[1:], value, info)
-        elif self._menu_horizontal_pointer == 5:
-            data = 'Time: {0}'.format(time.time())
-        elif self._menu_horizontal_pointer == 6:
-            data = 'Exception: {0}'.format(self._last_exception[:20])
-        elif self._menu_horizontal_pointer == 7:
-            data = 'Press B to reboot'
-        elif self._menu_horizontal_pointer == 8:
-            data = 'Press B to take a backup'
-        elif self._menu_horizontal_pointer == 9:
-            data = 'Press B to {0} markers'.format('hide' if self._show_markers else 'show')
-        elif self._menu_horizontal_pointer == 10:
-            log_entry = self._last_logline[:26]
-            if len(log_entry) < 26:
-                log_entry += ' ' * (26 - len(log_entry))
-            data = 'Log: {0}'.format(log_entry)
-        else:
-            data = 'Ticks: {0}'.format(', '.join('{0}'.format(self._ticks[key]) for key in self._tick_keys))
-        self._tft.text(0, self._tft.BOTTOM, '<', self._tft.DARKGREY)
-        self._tft.text(self._tft.RIGHT, self._tft.BOTTOM, '>', self._tft.DARKGREY)
-        if len(data) < 32:
-            padding = int(float(32 - len(data) + 1) / 2)
-            data = '{0}{1}{2}'.format(' ' * padding, data, ' ' * padding)
-        self._tft.text(self._tft.CENTER, self._tft.BOTTOM, data, self._tft.DARKGREY)
+                second = self._gc_count
+                third = self._gc_last_pause
+                fourth = self._gc_max_pause
+        key = self._menu_key
+        if (key[0] != self._menu_horizontal_pointer or key[1] != first or key[2] != second or
+                key[3] != third or key[4] != fourth):
+            key[0] = self._menu_horizontal_pointer
+            key[1] = first
+            key[2] = second
+            key[3] = third
+            key[4] = fourth
+            data = self._menu_text(page, feed_id, first, second, third, fourth)
+            self._tft.text(0, self._tft.BOTTOM, '<', self._tft.DARKGREY)
+            self._tft.text(self._tft.RIGHT, self._tft.BOTTOM, '>', self._tft.DARKGREY)
+            self._tft.text(self._tft.CENTER, self._tft.BOTTOM, '{0:^32}'.format(data), self._tft.DARKGREY)
         self._menu_tick_divider += 1
         if self._menu_tick_divider == 3:  # Increase menu tick every X seconds
             self._menu_tick += 1
-            if self._menu_tick == 4:
+            if self._menu_tick == self._menu_ticks:
                 self._menu_tick = 0
+            self._menu_timeline_pointer += 1
             self._menu_tick_divider = 0
 
+    def _stat(self, feed_id, stat):
+        """ Returns a stat (see _STAT_NAMES) of a feed, in centiwatts """
+        if stat == 0 or stat == 3:
+            self._store.read_averages(self._averages)
+            if stat == 0:
+                return min(self._buffer_min[feed_id] * 100, self._averages[feed_id] * 100, self._realtime[feed_id])
+            return max(self._buffer_max[feed_id] * 100, self._averages[feed_id] * 100, self._realtime[feed_id])
+        if stat == 1:
+            return self._buffer_avg[feed_id]
+        if stat == 2:
+            return self._buffer_avg[feed_id] + (self._buffer_stddev[feed_id] * 2)
+        if stat == 4:
+            return self._buffer_median[feed_id] * 100
+        return self._buffer_p90[feed_id] * 100
+
+    def _menu_text(self, page, feed_id, first, second, third, fourth):
+        """ Composes the menu line of a page, from the values collected by `_draw_menu` """
+        if page == _MENU_UPDATED:
+            if first:
+                return 'Updated:  {0:04d}/{1:02d}/{2:02d} {3:02d}:{4:02d}:{5:02d}'.format(*time.localtime(first)[:6])
+            return 'Updated:  0000/00/00 00:00:00'
+        if page == _MENU_BATTERY:
+            return 'Battery: {0}%'.format(first)
+        if page == _MENU_GRAPH:
+            return 'Graph: {0} {1}, max {2:.2f}W'.format(first, second, third)
+        if page == _MENU_STATS:
+            return '{0} stats: {1:.2f}W {2}'.format(self._feed_labels[feed_id], second / 100, _STAT_NAMES[first])
+        if page == _MENU_TIME:
+            return 'Time: {0}'.format(first)
+        if page == _MENU_EXCEPTION:
+            return 'Exception: {0:.20}'.format(first)
+        if page == _MENU_REBOOT:
+            return 'Press B to reboot'
+        if page == _MENU_BACKUP:
+            return 'Press B to take a backup'
+        if page == _MENU_MARKERS:
+            return 'Press B to {0} markers'.format('hide' if first else 'show')
+        if page == _MENU_LOG:
+            return 'Log: {0:<26.26}'.format(first)
+        if page == _MENU_TICKS:
+            ticks = self._ticks
+            return 'Ticks: {0}, {1}, {2}, {3}, {4}, {5}'.format(ticks['M'], ticks['D'], ticks['G'], ticks['B'], ticks['R'], ticks['E'])
+        if page == _MENU_BOOT:
+            stage, _, duration = self._timeline[first]
+            return 'Boot {0}: {1}us'.format(stage, duration)
+        if first == 0:
+            return 'Mem: {0}k free, {1}k block'.format(second, third)
+        return 'GC: {0}x, {1}us, max {2}us'.format(second, third, fourth)
+
     def _button_a_pressed(self, pin, pressed):
         _ = pin
         if pressed:
             self._ticks['B'] += 1
             self._menu_horizontal_pointer -= 1
             if self._menu_horizontal_pointer < 0:
-                self._menu_horizontal_pointer = 11
+                self._menu_horizontal_pointer = len(self._menu_pages) - 1
             self._blank_menu = True
 
     def _button_b_pressed(self, pin, pressed):
         _ = pin
         if pressed:
-            if self._menu_horizontal_pointer == 7:
+            page = self._menu_pages[self._menu_horizontal_pointer][0]
+            if page == _MENU_REBOOT:
                 self._reboot = True
-            elif self._menu_horizontal_pointer == 8:
+            elif page == _MENU_BACKUP:
                 self._backup = True
-            elif self._menu_horizontal_pointer == 9:
+            elif page == _MENU_MARKERS:
                 self._show_markers = not self._show_markers
                 self._save = True
 
@@ -540,17 +1009,10 @@ class Monitor(object):
         if pressed:
             self._ticks['B'] += 1
             self._menu_horizontal_pointer += 1
-            if self._menu_horizontal_pointer > 11:
+            if self._menu_horizontal_pointer >= len(self._menu_pages):
                 self._menu_horizontal_pointer = 0
             self._blank_menu = True
 
-    @staticmethod
-    def _stddev(entries):
-        """ returns the standard deviation of lst """
-        avg = sum(entries) / len(entries)
-        variance = sum([(e - avg) ** 2 for e in entries]) / len(entries)
-        return sqrt(variance)
-
     @staticmethod
     def _shorten(seconds):
         """ Converts seconds to a `xh ym ys` notation """
@@ -574,4 +1036,15 @@ class Monitor(object):
         print(message)
         self._last_logline = message
         if tft:
-            self._tft.text(0, 14, '{0}{1}'.format(message, ' ' * 50), self._tft.DARKGREY)
+            self._show_logline(message)
+
+    def _show_logline(self, text):
+        """ Shows text on the realtime line. Once the timer runs only the tick draws, so other threads hand it over """
+        if self._running:
+            self._pending_logline = text
+        else:
+            self._draw_logline(text)
+
+    def _draw_logline(self, text):
+        self._tft.text(0, 14, '{0}{1}'.format(text, ' ' * 50), self._tft.DARKGREY)
+        self._invalidate_realtime()